@@ -0,0 +1,126 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from Directory import Directory
+
+
+class AsyncFileSystem:
+    """Asyncio front end for FileSystem.
+
+    Every call runs the blocking FileSystem method on a bounded thread pool,
+    so the event loop stays responsive while disk work is in progress. Calls
+    that name the same directory entry (parent cluster + name) run in the
+    order they were made; all other calls overlap, and FileSystem's own locks
+    keep the concurrent work consistent. Cancelling a call that has already
+    started does not stop it: the next call on its entry still waits for it.
+    """
+
+    def __init__(self, fileSystem, maxWorkers=4):
+        self.fs = fileSystem
+        self._executor = ThreadPoolExecutor(max_workers=maxWorkers, thread_name_prefix="vfs")
+        self._entryLocks = {}  # (parent cluster, normalized name) -> [asyncio.Lock, users]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, excType, excValue, traceback):
+        await self.close()
+
+    async def close(self):
+        """Wait for running calls to finish and stop the worker threads."""
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._executor.shutdown)
+
+    # ---------------------------------------------------------
+    @staticmethod
+    def _entry(parentCluster, name):
+        return (parentCluster, Directory.normalizeName(name))
+
+    async def _acquire(self, key):
+        slot = self._entryLocks.get(key)
+        if slot is None:
+            slot = self._entryLocks[key] = [asyncio.Lock(), 0]
+        slot[1] += 1
+        try:
+            await slot[0].acquire()
+        except BaseException:
+            self._forget(key)
+            raise
+
+    def _release(self, keys):
+        for key in reversed(keys):
+            self._entryLocks[key][0].release()
+            self._forget(key)
+
+    def _forget(self, key):
+        slot = self._entryLocks[key]
+        slot[1] -= 1
+        if not slot[1]:
+            del self._entryLocks[key]
+
+    async def _run(self, entries, method, *args):
+        """Run method(*args) on the pool once the entry locks are held (taken in sorted order)."""
+        keys = sorted(set(entries))
+        held = []
+        try:
+            for key in keys:
+                await self._acquire(key)
+                held.append(key)
+        except BaseException:
+            self._release(held)
+            raise
+
+        loop = asyncio.get_running_loop()
+        future = self._executor.submit(method, *args)
+        # Released when the worker call finishes, not when the awaiting task
+        # is cancelled: the call keeps running and the next one must wait for it
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release, keys))
+        return await asyncio.shield(asyncio.wrap_future(future, loop=loop))
+
+    # ---------------------------------------------------------
+    async def createFile(self, parentCluster, fileName):
+        return await self._run([self._entry(parentCluster, fileName)], self.fs.createFile, parentCluster, fileName)
+
+    async def writeFile(self, parentCluster, fileName, data):
+        return await self._run([self._entry(parentCluster, fileName)], self.fs.writeFile, parentCluster, fileName, data)
+
+    async def writeFileAt(self, parentCluster, fileName, offset, data):
+        return await self._run(
+            [self._entry(parentCluster, fileName)], self.fs.writeFileAt, parentCluster, fileName, offset, data,
+        )
+
+    async def appendFile(self, parentCluster, fileName, data):
+        return await self._run([self._entry(parentCluster, fileName)], self.fs.appendFile, parentCluster, fileName, data)
+
+    async def readFile(self, parentCluster, fileName):
+        return await self._run([self._entry(parentCluster, fileName)], self.fs.readFile, parentCluster, fileName)
+
+    async def readFileBytes(self, parentCluster, fileName):
+        return await self._run([self._entry(parentCluster, fileName)], self.fs.readFileBytes, parentCluster, fileName)
+
+    async def deleteFile(self, parentCluster, fileName):
+        return await self._run([self._entry(parentCluster, fileName)], self.fs.deleteFile, parentCluster, fileName)
+
+    async def renameEntry(self, directoryCluster, oldName, newName):
+        entries = [self._entry(directoryCluster, oldName), self._entry(directoryCluster, newName)]
+        return await self._run(entries, self.fs.renameEntry, directoryCluster, oldName, newName)
+
+    async def copyFile(self, sourceCluster, sourceName, destCluster, destName):
+        entries = [self._entry(sourceCluster, sourceName), self._entry(destCluster, destName)]
+        return await self._run(entries, self.fs.copyFile, sourceCluster, sourceName, destCluster, destName)
+
+    async def moveFile(self, sourceCluster, sourceName, destCluster, destName):
+        entries = [self._entry(sourceCluster, sourceName), self._entry(destCluster, destName)]
+        return await self._run(entries, self.fs.moveFile, sourceCluster, sourceName, destCluster, destName)
+
+    async def createDirectory(self, parentCluster, dirName):
+        return await self._run([self._entry(parentCluster, dirName)], self.fs.createDirectory, parentCluster, dirName)
+
+    async def deleteDirectory(self, parentCluster, dirName):
+        return await self._run([self._entry(parentCluster, dirName)], self.fs.deleteDirectory, parentCluster, dirName)
+
+    async def listDirectory(self, directoryCluster):
+        # Not ordered against entry operations: it returns a snapshot
+        return await self._run([], self.fs.listDirectory, directoryCluster)
+
+    async def getFragmentation(self, parentCluster, name):
+        return await self._run([self._entry(parentCluster, name)], self.fs.getFragmentation, parentCluster, name)
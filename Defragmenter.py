@@ -0,0 +1,115 @@
+from collections import deque
+from Directory import DirectoryEntry
+from FATManager import FATManager
+
+
+class Defragmenter:
+    """Relocates file and directory chains into contiguous runs.
+
+    Work is kept in a queue so a pass can be split into bounded slices with
+    step(); each call resumes where the previous one stopped.
+    """
+
+    def __init__(self, fileSystem):
+        self.fs = fileSystem
+        self.disk = fileSystem.disk
+        self.fat = fileSystem.fat
+        self.directory = fileSystem.directory
+        self.reset()
+
+    def reset(self):
+        """Start a new pass from the root directory."""
+        # Items are ("scan", dirCluster) or ("move", parentCluster, name)
+        self._pending = deque([("scan", self.disk.root_cluster)])
+        self.clustersMoved = 0
+        self.entriesMoved = 0
+        self.entriesSkipped = 0
+
+    def isDone(self):
+        return not self._pending
+
+    def step(self, maxClusters=None):
+        """Process queued work until maxClusters have been moved (None = no limit).
+
+        Returns the number of clusters moved by this call.
+        """
+        moved = 0
+        while self._pending and (maxClusters is None or moved < maxClusters):
+            item = self._pending.popleft()
+            if item[0] == "scan":
+                for entry in self.directory.readDirectoryEntry(item[1]):
+                    self._pending.append(("move", item[1], entry.name))
+            else:
+                moved += self._moveEntry(item[1], item[2])
+        self.clustersMoved += moved
+        return moved
+
+    def run(self):
+        """Finish the current pass and return the total number of clusters moved."""
+        self.step()
+        return self.clustersMoved
+
+    def _moveEntry(self, parentCluster, name):
+        # The tree may have changed since the entry was queued
+        de = self.directory.findDirectoryEntry(parentCluster, name)
+        if not de:
+            return 0
+
+        moved = 0
+        firstCluster = de.firstCluster
+        chain = self.fat.followChain(firstCluster)
+        if self.fat.isShared(firstCluster):
+            # Relocating would have to update every entry that uses the chain
+            if FATManager.countRuns(chain) > 1:
+                self.entriesSkipped += 1
+        elif FATManager.countRuns(chain) > 1:
+            # The FAT relink and the parent entry update commit together
+            locked = [parentCluster, firstCluster] if de.attr == 0x01 else [parentCluster]
+            with self.fs.transactionLock, self.fs.lockDirectories(locked), self.fs.batch():
+                # Another thread may have changed the entry since it was read
+                current = self.directory.findDirectoryEntry(parentCluster, name)
+                if current is None or current.firstCluster != firstCluster:
+                    newFirst = None
+                else:
+                    de = current
+                    newFirst = self.fat.relocateChain(firstCluster)
+                if newFirst is not None:
+                    updated = DirectoryEntry(de.name, de.attr, newFirst, de.fileSize)
+                    self.directory.updateDirectoryEntry(parentCluster, de.name, updated)
+                    if de.attr == 0x01:
+                        # Index records name the clusters the entries used to live in
+                        self.directory.remapIndex(newFirst, chain)
+                        # Cached paths through the directory lead to its old, now free, cluster
+                        self.fs.dentryCache.invalidate(parentCluster, de.name)
+            if newFirst is None:
+                self.entriesSkipped += 1
+            else:
+                if de.attr == 0x01:
+                    # Cached slots of the directory point at its old clusters
+                    self.directory.invalidate(firstCluster)
+                firstCluster = newFirst
+                moved = len(chain)
+                self.entriesMoved += 1
+
+        if de.attr == 0x01:
+            self._pending.append(("scan", firstCluster))
+        return moved
+
+    def measureFragmentation(self):
+        """Walk the tree and return entry, fragmented-entry, run and cluster totals."""
+        stats = {"entries": 0, "fragmented": 0, "runs": 0, "clusters": 0}
+        pending = [self.disk.root_cluster]
+        while pending:
+            entries = self.directory.readDirectoryEntry(pending.pop())
+            chains = self.fat.followChains(entry.firstCluster for entry in entries)
+            for entry in entries:
+                chain = chains[entry.firstCluster]
+                runs = FATManager.countRuns(chain)
+                stats["entries"] += 1
+                stats["runs"] += runs
+                stats["clusters"] += len(chain)
+                if runs > 1:
+                    stats["fragmented"] += 1
+                if entry.attr == 0x01:
+                    pending.append(entry.firstCluster)
+        return stats
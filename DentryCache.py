@@ -0,0 +1,87 @@
+import threading
+from Directory import Directory
+from FsConstants import FsConstants
+
+
+class DentryCache:
+    """Caches directory paths -> first cluster so deep paths resolve without a full walk.
+
+    Paths are kept as tuples of normalized 8.3 names relative to the root
+    directory, e.g. "H:/docs/2024" -> ("DOCS", "2024"). Every prefix of a
+    resolved path is cached as well.
+    """
+
+    DRIVE = "H:"
+
+    def __init__(self, directory, rootCluster=FsConstants.ROOT_DIR_FIRST_CLUSTER):
+        self.directory = directory
+        self.rootCluster = rootCluster
+        self._paths = {(): rootCluster}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def splitPath(path, currentComponents=()):
+        """Turn a path into absolute components, resolving '.', '..' and the H: prefix.
+
+        Relative paths are taken from currentComponents. '..' at the root stays at the root.
+        """
+        path = path.strip().replace("\\", "/")
+        if path.upper().startswith(DentryCache.DRIVE):
+            parts = []
+            path = path[len(DentryCache.DRIVE):]
+        elif path.startswith("/"):
+            parts = []
+        else:
+            parts = list(currentComponents)
+
+        for part in path.split("/"):
+            if part in ("", "."):
+                continue
+            if part == "..":
+                if parts:
+                    parts.pop()
+                continue
+            parts.append(Directory.normalizeName(part))
+        return tuple(parts)
+
+    @staticmethod
+    def joinPath(components):
+        """Format components the way Shell shows its current path ("H:/A/B/")."""
+        return DentryCache.DRIVE + "/" + "".join(name + "/" for name in components)
+
+    def lookup(self, components):
+        """Return the first cluster of the directory at components, or None."""
+        cluster = self._paths.get(components)
+        if cluster is not None:
+            return cluster
+
+        with self._lock:
+            # Start from the longest prefix that is already cached
+            depth = len(components) - 1
+            while components[:depth] not in self._paths:
+                depth -= 1
+            cluster = self._paths[components[:depth]]
+
+            for i in range(depth, len(components)):
+                de = self.directory.findDirectoryEntry(cluster, components[i])
+                if not de or de.attr != 0x01:
+                    return None
+                cluster = de.firstCluster
+                self._paths[components[:i + 1]] = cluster
+            return cluster
+
+    def invalidate(self, parentCluster, name):
+        """Forget every cached path that goes through entry name of directory parentCluster."""
+        name = Directory.normalizeName(name)
+        with self._lock:
+            stale = [
+                key for key in self._paths
+                if key and key[-1] == name and self._paths.get(key[:-1]) == parentCluster
+            ]
+            for prefix in stale:
+                for key in [k for k in self._paths if k[:len(prefix)] == prefix]:
+                    del self._paths[key]
+
+    def clear(self):
+        with self._lock:
+            self._paths = {(): self.rootCluster}
@@ -1,9 +1,17 @@
 from FATManager import FATManager 
 from virtual_disk import VirtualDisk
-from FsConstants import FsConstants
+from DirectoryIndex import DirectoryIndex
 import re
+import struct
 
 class DirectoryEntry:
+    # Fixed attributes only: large directories hold many of these
+    __slots__ = ("name", "attr", "firstCluster", "fileSize")
+
+    # 11-byte 8.3 name, attribute, low 16 bits of the first cluster, file
+    # size, high 16 bits of the first cluster, reserved
+    LAYOUT = struct.Struct('<11sBHIH12x')
+
     def __init__(self, name, attr, firstCluster=5, fileSize=0):
         self.name = name
         self.attr = attr
@@ -15,111 +23,329 @@ class DirectoryEntry:
         # Format name to 8.3 and pad to 11 bytes (no dot)
         name = Directory.formatNameTo8Dot3(entry.name).replace('.', '')
         name_bytes = name.encode('ascii').ljust(11, b' ')
-        attr_byte = bytes([entry.attr])
-        first_cluster_bytes = entry.firstCluster.to_bytes(2, 'little')
-        file_size_bytes = entry.fileSize.to_bytes(4, 'little')
-        rest = b'\x00' * (Directory.ENTRY_SIZE - (11 + 1 + 2 + 4))
-        return name_bytes + attr_byte + first_cluster_bytes + file_size_bytes + rest
+        # The low 16 bits of the first cluster keep their original place; the
+        # high 16 bits go in the first reserved bytes so large disks fit
+        return DirectoryEntry.LAYOUT.pack(
+            name_bytes, entry.attr, entry.firstCluster & 0xFFFF, entry.fileSize, entry.firstCluster >> 16
+        )
     
     @staticmethod
     def bytesToDirectoryEntry(data):
-        # Read 11 bytes: 8 for base name, 3 for extension
-        rawName = data[0:11].decode('ascii')
-        baseName = rawName[0:8]  # First 8 chars (with padding)
-        ext = rawName[8:11]      # Last 3 chars (with padding)
-        # Only include extension if it's not all spaces
-        if ext.strip():
-            name = baseName.rstrip() + "." + ext.rstrip()
-        else:
-            name = baseName.rstrip()
-        attr = data[11]
-        firstCluster = int.from_bytes(data[12:14], 'little')
-        fileSize = int.from_bytes(data[14:18], 'little')
-        return DirectoryEntry(name, attr, firstCluster, fileSize)
+        rawName, attr, firstClusterLow, fileSize, firstClusterHigh = DirectoryEntry.LAYOUT.unpack(data)
+        return DirectoryEntry(
+            DirectoryEntry._decodeName(rawName), attr, firstClusterLow | firstClusterHigh << 16, fileSize
+        )
+
+    @staticmethod
+    def decodeCluster(data):
+        """Yield (slot, entry) for every slot of a directory cluster; entry is None for a free slot.
+
+        The whole cluster is unpacked in one pass instead of slicing each slot.
+        The hidden directory index marker is neither an entry nor free, so it
+        is skipped.
+        """
+        decodeName = DirectoryEntry._decodeName
+        for slot, (rawName, attr, firstClusterLow, fileSize, firstClusterHigh) in enumerate(
+            DirectoryEntry.LAYOUT.iter_unpack(data)
+        ):
+            if rawName[0] == 0x00:
+                yield slot, None
+            elif rawName[0] != DirectoryIndex.MARKER:
+                yield slot, DirectoryEntry(
+                    decodeName(rawName), attr, firstClusterLow | firstClusterHigh << 16, fileSize
+                )
+
+    @staticmethod
+    def _decodeName(rawName):
+        # 8 bytes of base name and 3 of extension, both space padded; the
+        # extension is only shown if it is not all spaces
+        baseName = rawName[:8].rstrip()
+        ext = rawName[8:].rstrip()
+        return (baseName + b"." + ext if ext else baseName).decode('ascii')
 
 
 class Directory:
     ENTRY_SIZE = 32
+    # Directories that grow to this many entries get an on-disk DirectoryIndex
+    INDEX_THRESHOLD = 512
     
     def __init__(self, disk, fat):
         self.disk = disk
         self.fat = fat
         self.entries = []
+        # Parsed directory cache, keyed by a directory's first cluster:
+        #   names: normalized 8.3 name -> (DirectoryEntry, cluster, slot index);
+        #          the entries are shared with findDirectoryEntry callers, so
+        #          changes always replace them instead of editing them
+        #   free:  unused (cluster, slot index) pairs, next one to use last
+        self._index = {}
+
+    def _getIndex(self, clusterNumber):
+        """Return the cached index for a directory, scanning its chain on first use."""
+        index = self._index.get(clusterNumber)
+        if index is not None:
+            return index
+
+        names = {}
+        free = []
+        for cluster in self.fat.followChain(clusterNumber):
+            for i, de in DirectoryEntry.decodeCluster(self.disk.view_cluster(cluster)):
+                if de is None:
+                    free.append((cluster, i))
+                    continue
+                # Keep the first slot if a name appears twice, as a linear scan would
+                names.setdefault(de.name, (de, cluster, i))
+        free.reverse()
+        index = {"names": names, "free": free}
+        self._index[clusterNumber] = index
+        return index
+
+    def invalidate(self, clusterNumber=None):
+        """Drop the cached index of one directory (or of every directory)."""
+        if clusterNumber is None:
+            self._index.clear()
+        else:
+            self._index.pop(clusterNumber, None)
+
+    def _writeSlot(self, cluster, slot, entryBytes):
+        clusterData = bytearray(self.disk.read_cluster(cluster))
+        clusterData[slot * Directory.ENTRY_SIZE:(slot + 1) * Directory.ENTRY_SIZE] = entryBytes
+        self.disk.write_cluster(cluster, bytes(clusterData), metadata=True)
 
     def readDirectoryEntry(self, clusterNumber):
-        # get the directory cluster chain
-        result = []
-        chain = self.fat.followChain(clusterNumber)
-        # read every cluster and divide into entries
-        for cluster in chain: 
-            clusterData = self.disk.read_cluster(cluster)
-            clusterEntries = FsConstants.CLUSTER_SIZE // Directory.ENTRY_SIZE
-            # read every entry and append to the result array
-            for i in range(clusterEntries):
-                entryData = clusterData[i * Directory.ENTRY_SIZE:(i + 1) * Directory.ENTRY_SIZE]
-                if entryData[0] == 0x00:
-                    continue  # Unused entry
-                de = DirectoryEntry.bytesToDirectoryEntry(entryData)
-                result.append(de)
-        return result
+        """Return copies of a directory's entries, in the order they sit on disk."""
+        return self._entriesInOrder(clusterNumber, self._getIndex(clusterNumber))
+
+    def _entriesInOrder(self, clusterNumber, index):
+        # The name map is in insertion order; listings follow the slots instead
+        position = {cluster: i for i, cluster in enumerate(self.fat.followChain(clusterNumber))}
+        found = sorted(index["names"].values(), key=lambda item: (position[item[1]], item[2]))
+        return [DirectoryEntry(de.name, de.attr, de.firstCluster, de.fileSize) for de, _, _ in found]
+
+    def scanDirectory(self, clusterNumber):
+        """Yield a directory's entries one at a time, like os.scandir.
+
+        Uses the cached index when the directory has one; otherwise the chain
+        is decoded a cluster at a time and nothing is cached, so a one-off
+        scan of a big tree does not fill the index.
+        """
+        index = self._index.get(clusterNumber)
+        if index is not None:
+            # A snapshot, so changes during the scan are safe
+            yield from self._entriesInOrder(clusterNumber, index)
+            return
+
+        contentStart, clusterCount = self.disk.content_start, self.disk.cluster_count
+        cluster = clusterNumber
+        while True:
+            for _, de in DirectoryEntry.decodeCluster(self.disk.read_cluster(cluster)):
+                if de is not None:
+                    yield de
+            cluster = self.fat.getFatEntry(cluster)
+            # Same end-of-chain rules as FATManager.followChain
+            if cluster < contentStart or cluster >= clusterCount:
+                break
+
+    def walk(self, clusterNumber, maxDepth=None, descend=None):
+        """Yield (path, entry) for everything below a directory, depth first.
+
+        path is relative to clusterNumber, with '/' between names. Only one
+        scanDirectory generator per level is alive at a time, so memory grows
+        with the depth of the tree, not its size. Directories deeper than
+        maxDepth (1 = direct children only) are not entered, nor are those
+        for which descend(path, entry) returns False.
+        """
+        stack = [("", self.scanDirectory(clusterNumber))]
+        while stack:
+            prefix, entries = stack[-1]
+            de = next(entries, None)
+            if de is None:
+                stack.pop()
+                continue
+            path = prefix + de.name
+            yield path, de
+            if de.attr != 0x01 or (maxDepth is not None and len(stack) >= maxDepth):
+                continue
+            if descend is None or descend(path, de):
+                stack.append((path + "/", self.scanDirectory(de.firstCluster)))
+
+    def walkTree(self, clusterNumber):
+        """Yield (parentCluster, entry) for everything below a directory, parents before children.
+
+        Iterative, so deep trees do not run into the recursion limit.
+        """
+        pending = [clusterNumber]
+        while pending:
+            parentCluster = pending.pop()
+            for de in self.scanDirectory(parentCluster):
+                yield parentCluster, de
+                if de.attr == 0x01:
+                    pending.append(de.firstCluster)
 
     def findDirectoryEntry(self, clusterNumber, entryName):
+        """Return the entry named entryName, or None.
+
+        The entry may be the cached object itself: treat it as read-only and
+        pass a new DirectoryEntry to updateDirectoryEntry to change it.
+        """
         # Normalize the target name for comparison (8.3 format without padding)
-        formatted = Directory.formatNameTo8Dot3(entryName)
-        # Strip the padded format to match bytesToDirectoryEntry output
-        baseName, ext = formatted.split('.') if '.' in formatted else (formatted, '')
-        targetName = baseName.rstrip() + ("." + ext.rstrip() if ext.strip() else "")
-        chain = self.fat.followChain(clusterNumber)
-        #read every cluster and divide into entries
-        for cluster in chain:
-            clusterData = self.disk.read_cluster(cluster)
-            # read every entry and compare against target
-            for i in range(FsConstants.CLUSTER_SIZE // Directory.ENTRY_SIZE):
-                entryData = clusterData[i * Directory.ENTRY_SIZE:(i + 1) * Directory.ENTRY_SIZE]
-                if entryData[0] == 0x00:
-                    continue  # Unused entry
-                de = DirectoryEntry.bytesToDirectoryEntry(entryData)
-                if de.name == targetName:
-                    return de
-        # No results
+        name = Directory.normalizeName(entryName)
+        if clusterNumber not in self._index:
+            # An indexed directory is not scanned just to find one entry
+            diskIndex = DirectoryIndex.open(self.disk, self.fat, clusterNumber)
+            if diskIndex is not None:
+                found = self._findIndexed(diskIndex, name)
+                return found[0] if found else None
+        found = self._getIndex(clusterNumber)["names"].get(name)
+        return found[0] if found else None
+
+    def _findIndexed(self, diskIndex, name):
+        """Look name up through the on-disk index; returns (DirectoryEntry, cluster, slot) or None."""
+        for cluster, slot in diskIndex.lookup(DirectoryIndex.nameHash(name)):
+            de = DirectoryEntry.bytesToDirectoryEntry(
+                self.disk.view_cluster(cluster)[slot * Directory.ENTRY_SIZE:(slot + 1) * Directory.ENTRY_SIZE]
+            )
+            if de.name == name:
+                return de, cluster, slot
         return None
 
+    def _lookup(self, clusterNumber, name):
+        """Return (cached index, on-disk index, (DirectoryEntry, cluster, slot)) for a change to name.
+
+        The cached index is None when the on-disk index answered instead;
+        either of the other two is None when missing.
+        """
+        index = self._index.get(clusterNumber)
+        diskIndex = DirectoryIndex.open(self.disk, self.fat, clusterNumber)
+        if index is None and diskIndex is not None:
+            return None, diskIndex, self._findIndexed(diskIndex, name)
+        index = self._getIndex(clusterNumber)
+        return index, diskIndex, index["names"].get(name)
+
+    def _takeFreeSlot(self, clusterNumber, index):
+        if not index["free"]:
+            # Directory is full: grow it by one zeroed cluster
+            newCluster = self.fat.addClustersToChain(clusterNumber, 1)
+            slotsPerCluster = self.disk.cluster_size // Directory.ENTRY_SIZE
+            index["free"] = [(newCluster, i) for i in reversed(range(slotsPerCluster))]
+        return index["free"].pop()
+
+    def _findFreeSlot(self, clusterNumber, diskIndex):
+        """Find a free slot without scanning the directory: try the index's hint, then the last cluster."""
+        for cluster in (diskIndex.freeHint, self.fat.getChainTail(clusterNumber)):
+            if cluster:
+                # First name byte of every slot; 0x00 marks a free one
+                slot = bytes(self.disk.view_cluster(cluster)[::Directory.ENTRY_SIZE]).find(0x00)
+                if slot >= 0:
+                    diskIndex.freeHint = cluster
+                    return cluster, slot
+        cluster = self.fat.addClustersToChain(clusterNumber, 1)
+        diskIndex.freeHint = cluster
+        return cluster, 0
+
+    def _buildIndex(self, clusterNumber, index):
+        """Give a directory an on-disk index of its cached entries."""
+        names = index["names"]
+        # The marker pointing at the index takes slot 0 of the first cluster
+        occupant = next(
+            (name for name, (_, cluster, slot) in names.items() if (cluster, slot) == (clusterNumber, 0)), None
+        )
+        if occupant is None:
+            index["free"].remove((clusterNumber, 0))
+        else:
+            cluster, slot = self._takeFreeSlot(clusterNumber, index)
+            self._writeSlot(cluster, slot, bytes(self.disk.view_cluster(clusterNumber)[:Directory.ENTRY_SIZE]))
+            names[occupant] = (names[occupant][0], cluster, slot)
+        DirectoryIndex.create(
+            self.disk, self.fat, clusterNumber,
+            [(DirectoryIndex.nameHash(name), cluster, slot) for name, (_, cluster, slot) in names.items()],
+        )
+
     def addDirectoryEntry(self, clusterNumber, entry):
-        #follow chain searching for an empty entry slot
-        chain = self.fat.followChain(clusterNumber)
-        for cluster in chain:
-            clusterData = bytearray(self.disk.read_cluster(cluster))
-            for i in range(FsConstants.CLUSTER_SIZE // Directory.ENTRY_SIZE):
-                entryData = clusterData[i * Directory.ENTRY_SIZE:(i + 1) * Directory.ENTRY_SIZE]
-                if entryData[0] == 0x00:
-                    # Found an empty entry slot
-                    entryBytes = DirectoryEntry.directoryEntryToBytes(entry)
-                    clusterData[i * Directory.ENTRY_SIZE:(i + 1) * Directory.ENTRY_SIZE] = entryBytes
-                    self.disk.write_cluster(cluster, bytes(clusterData))
-                    return
-        #if no slots found, allocate new cluster and recurse on the add function
-        newCluster = self.fat.addClustersToChain(clusterNumber, 1)
-        self.addDirectoryEntry(newCluster, entry)
+        entryBytes = DirectoryEntry.directoryEntryToBytes(entry)
+        de = DirectoryEntry.bytesToDirectoryEntry(entryBytes)
+        index, diskIndex, _ = self._lookup(clusterNumber, de.name)
+        if index is None:
+            cluster, slot = self._findFreeSlot(clusterNumber, diskIndex)
+        else:
+            cluster, slot = self._takeFreeSlot(clusterNumber, index)
+            index["names"][de.name] = (de, cluster, slot)
+        self._writeSlot(cluster, slot, entryBytes)
+        if diskIndex is not None:
+            diskIndex.insert(DirectoryIndex.nameHash(de.name), cluster, slot)
+        elif len(index["names"]) >= Directory.INDEX_THRESHOLD:
+            self._buildIndex(clusterNumber, index)
 
     def removeDirectoryEntry(self, clusterNumber, entryName):
-        #find the needed directory and normalize name for comparison
-        formatted = Directory.formatNameTo8Dot3(entryName)
+        name = Directory.normalizeName(entryName)
+        index, diskIndex, found = self._lookup(clusterNumber, name)
+        if not found:
+            return False
+        _, cluster, slot = found
+        # Mark as deleted by zeroing first byte
+        clusterData = bytearray(self.disk.read_cluster(cluster))
+        clusterData[slot * Directory.ENTRY_SIZE] = 0x00
+        self.disk.write_cluster(cluster, bytes(clusterData), metadata=True)
+        if index is not None:
+            del index["names"][name]
+            index["free"].append((cluster, slot))
+        if diskIndex is not None:
+            diskIndex.remove(DirectoryIndex.nameHash(name), cluster, slot)
+        return True
+
+    def updateDirectoryEntry(self, clusterNumber, entryName, entry):
+        """Overwrite an existing entry in its current slot. Returns False if not found.
+
+        entry may carry a new name, which renames the entry in place.
+        """
+        name = Directory.normalizeName(entryName)
+        index, diskIndex, found = self._lookup(clusterNumber, name)
+        if not found:
+            return False
+        _, cluster, slot = found
+        entryBytes = DirectoryEntry.directoryEntryToBytes(entry)
+        self._writeSlot(cluster, slot, entryBytes)
+        de = DirectoryEntry.bytesToDirectoryEntry(entryBytes)
+        if index is not None:
+            del index["names"][name]
+            index["names"][de.name] = (de, cluster, slot)
+        if diskIndex is not None and de.name != name:
+            diskIndex.remove(DirectoryIndex.nameHash(name), cluster, slot)
+            diskIndex.insert(DirectoryIndex.nameHash(de.name), cluster, slot)
+        return True
+
+    def freeIndex(self, clusterNumber):
+        """Release a directory's on-disk index, if it has one. Call before freeing the directory."""
+        diskIndex = DirectoryIndex.open(self.disk, self.fat, clusterNumber)
+        if diskIndex is not None:
+            diskIndex.free()
+
+    def remapIndex(self, clusterNumber, oldChain):
+        """Point a directory's on-disk index at the clusters its chain was moved to from oldChain."""
+        diskIndex = DirectoryIndex.open(self.disk, self.fat, clusterNumber)
+        if diskIndex is not None:
+            diskIndex.remap(dict(zip(oldChain, self.fat.followChain(clusterNumber))))
+
+    @staticmethod
+    def normalizeName(name):
+        """Convert a name to the form bytesToDirectoryEntry produces (8.3 without padding)."""
+        formatted = Directory.formatNameTo8Dot3(name)
         baseName, ext = formatted.split('.') if '.' in formatted else (formatted, '')
-        targetName = baseName.rstrip() + ("." + ext.rstrip() if ext.strip() else "")
-        chain = self.fat.followChain(clusterNumber)
-        for cluster in chain:
-            clusterData = bytearray(self.disk.read_cluster(cluster))
-            for i in range(FsConstants.CLUSTER_SIZE // Directory.ENTRY_SIZE):
-                entryData = clusterData[i * Directory.ENTRY_SIZE:(i + 1) * Directory.ENTRY_SIZE]
-                if entryData[0] != 0x00:
-                    de = DirectoryEntry.bytesToDirectoryEntry(bytes(entryData))
-                    if de.name == targetName:
-                        # Mark as deleted by zeroing first byte
-                        clusterData[i * Directory.ENTRY_SIZE] = 0x00
-                        #flush changes to disk
-                        self.disk.write_cluster(cluster, bytes(clusterData))
-                        return True
-        return False
+        return baseName.rstrip() + ("." + ext.rstrip() if ext.strip() else "")
+
+    @staticmethod
+    def isValidName(name):
+        """Return True if name can be given to a new entry.
+
+        Names with control characters are refused rather than quietly
+        stripped: on disk the first name byte marks free slots (0x00) and the
+        index marker (DirectoryIndex.MARKER). The base name must also keep at
+        least one character once formatted.
+        """
+        if name.count('.') > 1 or any(ord(ch) < 0x20 or ord(ch) == 0x7F for ch in name):
+            return False
+        normalized = Directory.normalizeName(name)
+        return bool(normalized) and not normalized.startswith('.')
 
     @staticmethod
     def formatNameTo8Dot3(name):
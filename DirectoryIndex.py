@@ -0,0 +1,208 @@
+import struct
+import zlib
+
+
+class DirectoryIndex:
+    """On-disk hash index of one directory's entries, kept in a sidecar cluster chain.
+
+    The directory points at the index with a hidden marker entry in slot 0
+    of its first cluster: the first name byte is MARKER and the first
+    cluster field holds the index chain. Listings skip the marker.
+
+    The chain holds a header followed by an open-addressing table with
+    linear probing. Each record stores a CRC-32 of the entry's normalized
+    8.3 name and the (cluster, slot) the entry lives in. Names are checked
+    against the slot itself, so a hash collision costs one extra read, and
+    a lookup or insert touches a constant number of clusters.
+    """
+
+    MARKER = 0x01
+    # capacity (records, a power of two), live records, deleted records,
+    # cluster of the directory most likely to have a free slot (0 = unknown)
+    HEADER = struct.Struct('<IIII')
+    # name hash, entry cluster, slot + 1 (EMPTY = never used, DELETED = removed)
+    RECORD = struct.Struct('<IIH6x')
+    EMPTY = 0
+    DELETED = 0xFFFF
+    MIN_CAPACITY = 64
+
+    def __init__(self, disk, fat, directoryCluster, head):
+        self.disk = disk
+        self.fat = fat
+        self.directoryCluster = directoryCluster
+        self.head = head
+        self.capacity, self.used, self.deleted, self.freeHint = DirectoryIndex.HEADER.unpack_from(
+            disk.read_cluster(head)
+        )
+
+    @staticmethod
+    def nameHash(name):
+        return zlib.crc32(name.encode('ascii'))
+
+    # ---------------------------------------------------------
+    @classmethod
+    def open(cls, disk, fat, directoryCluster):
+        """Return the index of a directory, or None if it does not have one."""
+        data = disk.read_cluster(directoryCluster)
+        if data[0] != cls.MARKER:
+            return None
+        return cls(disk, fat, directoryCluster, cls._markerTarget(data))
+
+    @classmethod
+    def create(cls, disk, fat, directoryCluster, records, freeHint=0):
+        """Build an index over (name hash, cluster, slot) records and point the directory at it.
+
+        Slot 0 of the directory's first cluster must be free: the marker goes there.
+        """
+        head = cls._writeTable(disk, fat, records, freeHint)
+        cls._writeMarker(disk, directoryCluster, head)
+        return cls(disk, fat, directoryCluster, head)
+
+    def free(self):
+        """Release the index chain (the directory is being freed too)."""
+        self.fat.freeChain(self.head)
+
+    # ---------------------------------------------------------
+    def lookup(self, nameHash):
+        """Yield (cluster, slot) for every live record with this name hash."""
+        for _, storedHash, cluster, slot in self._probe(nameHash):
+            if storedHash == nameHash and slot not in (DirectoryIndex.EMPTY, DirectoryIndex.DELETED):
+                yield cluster, slot - 1
+
+    def insert(self, nameHash, cluster, slot):
+        """Record an entry stored at (cluster, slot)."""
+        if (self.used + self.deleted + 1) * 2 > self.capacity:
+            # Keep the table at most half full so probe runs stay short
+            self._rebuild(self.used + 1)
+        # Reuse the first deleted record on the probe run, else its empty end
+        for position, _, _, storedSlot in self._probe(nameHash):
+            if storedSlot == DirectoryIndex.DELETED:
+                self.deleted -= 1
+                break
+        self._writeRecord(position, nameHash, cluster, slot + 1)
+        self.used += 1
+        self._saveHeader()
+
+    def remove(self, nameHash, cluster, slot):
+        """Forget the entry stored at (cluster, slot). Returns False if it was not indexed."""
+        for position, storedHash, storedCluster, storedSlot in self._probe(nameHash):
+            if storedHash == nameHash and storedCluster == cluster and storedSlot == slot + 1:
+                self._writeRecord(position, nameHash, cluster, DirectoryIndex.DELETED)
+                self.used -= 1
+                self.deleted += 1
+                # The freed slot is the cheapest place for the next entry
+                self.freeHint = cluster
+                self._saveHeader()
+                return True
+        return False
+
+    def remap(self, clusterMap):
+        """Rewrite record clusters after the directory's chain moved (old cluster -> new cluster)."""
+        chain = self.fat.followChain(self.head)
+        for cluster in chain:
+            data = bytearray(self.disk.read_cluster(cluster))
+            for offset in range(0, len(data), DirectoryIndex.RECORD.size):
+                if cluster == self.head and offset < DirectoryIndex.HEADER.size:
+                    continue
+                storedHash, storedCluster, storedSlot = DirectoryIndex.RECORD.unpack_from(data, offset)
+                if storedCluster in clusterMap:
+                    DirectoryIndex.RECORD.pack_into(data, offset, storedHash, clusterMap[storedCluster], storedSlot)
+            self.disk.write_cluster(cluster, bytes(data), metadata=True)
+        self.freeHint = clusterMap.get(self.freeHint, 0)
+        self._saveHeader()
+
+    # ---------------------------------------------------------
+    def _probe(self, nameHash):
+        """Yield (position, hash, cluster, slot) along the probe run of nameHash, ending with its empty record."""
+        mask = self.capacity - 1
+        position = nameHash & mask
+        chain = self.fat.followChain(self.head)
+        clusterSize = self.disk.cluster_size
+        loadedIndex, data = None, None
+        while True:
+            chainIndex, offset = divmod(DirectoryIndex.HEADER.size + position * DirectoryIndex.RECORD.size, clusterSize)
+            if chainIndex != loadedIndex:
+                loadedIndex, data = chainIndex, self.disk.read_cluster(chain[chainIndex])
+            storedHash, cluster, slot = DirectoryIndex.RECORD.unpack_from(data, offset)
+            yield position, storedHash, cluster, slot
+            if slot == DirectoryIndex.EMPTY:
+                return
+            position = (position + 1) & mask
+
+    def _writeRecord(self, position, nameHash, cluster, slot):
+        chainIndex, offset = divmod(
+            DirectoryIndex.HEADER.size + position * DirectoryIndex.RECORD.size, self.disk.cluster_size
+        )
+        tableCluster = self.fat.followChain(self.head)[chainIndex]
+        data = bytearray(self.disk.read_cluster(tableCluster))
+        DirectoryIndex.RECORD.pack_into(data, offset, nameHash, cluster, slot)
+        self.disk.write_cluster(tableCluster, bytes(data), metadata=True)
+
+    def _saveHeader(self):
+        data = bytearray(self.disk.read_cluster(self.head))
+        DirectoryIndex.HEADER.pack_into(data, 0, self.capacity, self.used, self.deleted, self.freeHint)
+        self.disk.write_cluster(self.head, bytes(data), metadata=True)
+
+    def _records(self):
+        """Yield (hash, cluster, slot) for every live record."""
+        chain = self.fat.followChain(self.head)
+        for chainIndex, cluster in enumerate(chain):
+            data = self.disk.read_cluster(cluster)
+            start = DirectoryIndex.HEADER.size if chainIndex == 0 else 0
+            for storedHash, storedCluster, storedSlot in DirectoryIndex.RECORD.iter_unpack(memoryview(data)[start:]):
+                if storedSlot not in (DirectoryIndex.EMPTY, DirectoryIndex.DELETED):
+                    yield storedHash, storedCluster, storedSlot - 1
+
+    def _rebuild(self, minimumRecords):
+        """Move the records into a new table sized for minimumRecords and drop the old chain."""
+        records = list(self._records())
+        oldHead = self.head
+        self.head = DirectoryIndex._writeTable(
+            self.disk, self.fat, records, self.freeHint, max(minimumRecords, len(records))
+        )
+        DirectoryIndex._writeMarker(self.disk, self.directoryCluster, self.head)
+        self.fat.freeChain(oldHead)
+        self.capacity, self.used, self.deleted, self.freeHint = DirectoryIndex.HEADER.unpack_from(
+            self.disk.read_cluster(self.head)
+        )
+
+    # ---------------------------------------------------------
+    @staticmethod
+    def _writeTable(disk, fat, records, freeHint, minimumRecords=0):
+        """Write a new table holding records to a newly allocated chain and return its first cluster."""
+        capacity = DirectoryIndex.MIN_CAPACITY
+        while capacity < 2 * max(len(records), minimumRecords):
+            capacity *= 2
+        clusterSize = disk.cluster_size
+        size = DirectoryIndex.HEADER.size + capacity * DirectoryIndex.RECORD.size
+        table = bytearray(-(-size // clusterSize) * clusterSize)
+        DirectoryIndex.HEADER.pack_into(table, 0, capacity, len(records), 0, freeHint)
+        mask = capacity - 1
+        for nameHash, cluster, slot in records:
+            position = nameHash & mask
+            while True:
+                offset = DirectoryIndex.HEADER.size + position * DirectoryIndex.RECORD.size
+                if DirectoryIndex.RECORD.unpack_from(table, offset)[2] == DirectoryIndex.EMPTY:
+                    break
+                position = (position + 1) & mask
+            DirectoryIndex.RECORD.pack_into(table, offset, nameHash, cluster, slot + 1)
+
+        # Every cluster of the chain is written below, so it does not need zeroing first
+        head = fat.allocateChain(len(table) // clusterSize, zeroFill=False)
+        for i, cluster in enumerate(fat.followChain(head)):
+            disk.write_cluster(cluster, bytes(table[i * clusterSize:(i + 1) * clusterSize]), metadata=True)
+        return head
+
+    # The marker uses the directory entry layout, so its first cluster
+    # field sits where an entry's does
+    @staticmethod
+    def _markerTarget(data):
+        _, _, firstClusterLow, _, firstClusterHigh = struct.unpack_from('<11sBHIH', data)
+        return firstClusterLow | firstClusterHigh << 16
+
+    @staticmethod
+    def _writeMarker(disk, directoryCluster, head):
+        data = bytearray(disk.read_cluster(directoryCluster))
+        name = bytes([DirectoryIndex.MARKER]) + b' ' * 10
+        struct.pack_into('<11sBHIH12x', data, 0, name, 0x00, head & 0xFFFF, 0, head >> 16)
+        disk.write_cluster(directoryCluster, bytes(data), metadata=True)
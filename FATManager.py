@@ -1,109 +1,600 @@
-from FsConstants import FsConstants
+import sys
+import bisect
+import struct
+import operator
+import functools
+import threading
+from array import array
 from Converter import Converter
 
 
+def _locked(method):
+    """Serialize a FATManager method on the manager's lock (reentrant)."""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
 
 class FATManager:
+    ENTRY_SIZE = 4  # Each FAT entry is a little-endian int32
+    # The legacy layout stored entries as 4-byte ASCII strings. Entry 0 (the
+    # superblock) is always "-1" once a FAT has been initialized, which tells
+    # the two layouts apart: the packed format stores it as b'\xff\xff\xff\xff'.
+    LEGACY_FAT_SIGNATURE = b'-1\x00\x00'
+    COPY_BUFFER_BYTES = 1 << 20  # Chains are copied at most this much at a time
 
     
-    def __init__(self, disk):
+    # freeCount: free-cluster count cached in a cleanly unmounted superblock.
+    # When given, the free-cluster bitmap is only built on the first allocation.
+    def __init__(self, disk, freeCount=None):
         self.disk = disk
-        self.fat = self.LoadFatFromDisk()
+        self._lock = threading.RLock()  # FAT, free-space index, chain cache and reference counts
+        self.entriesPerCluster = disk.cluster_size // FATManager.ENTRY_SIZE
+        self._dirtyFatClusters = set()  # FAT clusters changed since the last flush
+        self._freeMap = None  # 1 for every free content cluster, 0 otherwise; built lazily
+        self._freeCount = 0
+        # Free runs, built with the free map and kept in step with it: run start ->
+        # length, run end (exclusive) -> start, length -> starts of the runs that
+        # long, and the lengths present in sorted order for best-fit lookups
+        self._runLength = {}
+        self._runEnd = {}
+        self._runsByLength = {}
+        self._runLengths = []
+        self._nextFreeHint = disk.content_start
+        self._batchUndo = None  # (clusterIndex, oldValue) pairs recorded since beginBatch()
+        # Chain cache: first cluster -> cluster list, and member cluster -> first cluster.
+        # Every cached cluster belongs to exactly one cached chain.
+        self._chainCache = {}
+        self._chainOwner = {}
+        self.maxCachedClusters = 65536
+        # Reference counts of chains shared by cloned files: first cluster -> number
+        # of directory entries using the chain. Chains with one owner are not listed.
+        self._refCounts = {}
+        self._refCountsDirty = False
+        self._refTableStart = 0  # first cluster of the on-disk reference count table
+        self._batchRefCounts = None  # reference count state saved by beginBatch()
+        self.fat = self.LoadFatFromDisk(freeCount)
         # Initialize reserved clusters on first load if needed
         self._initializeReservedClusters()
+        self._loadRefCounts()
+
+    def _fatClusters(self):
+        return range(self.disk.fat_start, self.disk.fat_end + 1)
+
+    def LoadFatFromDisk(self, freeCount=None):
+        raw = b''.join(self.disk.view_cluster(clusterIndex) for clusterIndex in self._fatClusters())
+        if raw.startswith(FATManager.LEGACY_FAT_SIGNATURE):
+            return self.migrateLegacyFat(raw)
+        fatData = array('i')
+        fatData.frombytes(raw)
+        if sys.byteorder == 'big':
+            fatData.byteswap()
+        self.fat = fatData
+        self._dirtyFatClusters.clear()
+        self.clearChainCache()
+        if freeCount is None:
+            self._rebuildFreeMap()
+        else:
+            self._freeMap = None
+            self._freeCount = freeCount
+        return fatData
 
-    def LoadFatFromDisk(self):
-        entry_size = 4  
-        entries_per_cluster = FsConstants.CLUSTER_SIZE // entry_size
-        fatData = []
-        for clusterIndex in range(FsConstants.FAT_START_CLUSTER, FsConstants.FAT_END_CLUSTER + 1):
-            cluster_bytes = self.disk.read_cluster(clusterIndex)
-            for i in range(0, len(cluster_bytes), entry_size):
-                entry_bytes = cluster_bytes[i:i+entry_size]
-                entry_str = Converter.bytesToString(entry_bytes)
-                if entry_str.strip() == '':
-                    entry_value = 0
-                else:
-                    entry_value = int(entry_str)
-                fatData.append(entry_value)
+    def migrateLegacyFat(self, raw=None):
+        """Convert a FAT stored as ASCII decimal strings to the packed int32 layout."""
+        if raw is None:
+            raw = b''.join(self.disk.read_cluster(clusterIndex) for clusterIndex in self._fatClusters())
+        fatData = array('i')
+        for i in range(0, len(raw), FATManager.ENTRY_SIZE):
+            entry_str = Converter.bytesToString(raw[i:i + FATManager.ENTRY_SIZE])
+            if entry_str.strip() == '':
+                fatData.append(0)
+            else:
+                fatData.append(int(entry_str))
         self.fat = fatData
+        self._markAllFatDirty()
+        self.clearChainCache()
+        self._rebuildFreeMap()
+        self.flushFatToDisk()
         return fatData
     
+    @_locked
     def flushFatToDisk(self):
-        entry_size = 4 
-        entries_per_cluster = FsConstants.CLUSTER_SIZE // entry_size
-        for clusterIndex in range(FsConstants.FAT_START_CLUSTER, FsConstants.FAT_END_CLUSTER + 1):
-            start = (clusterIndex - FsConstants.FAT_START_CLUSTER) * entries_per_cluster
-            end = start + entries_per_cluster
-            fat_bytes = b''.join(
-                Converter.stringToBytes(str(self.fat[i]), entry_size) for i in range(start, end)
-            )
-            self.disk.write_cluster(clusterIndex, fat_bytes)
+        """Write the FAT clusters that changed since the last flush."""
+        if self._batchUndo is not None:
+            return  # Deferred until endBatch()
+        # May allocate table clusters, so it goes before the FAT clusters are written
+        self._flushRefCounts()
+        for clusterIndex in sorted(self._dirtyFatClusters):
+            start = (clusterIndex - self.disk.fat_start) * self.entriesPerCluster
+            fatData = self.fat[start:start + self.entriesPerCluster]
+            if sys.byteorder == 'big':
+                fatData.byteswap()
+            self.disk.write_cluster(clusterIndex, fatData.tobytes(), metadata=True)
+        self._dirtyFatClusters.clear()
+
+    @_locked
+    def beginBatch(self):
+        """Defer FAT flushes and start recording changes for rollbackBatch()."""
+        self._batchUndo = []
+        self._batchRefCounts = (dict(self._refCounts), self._refCountsDirty, self._refTableStart)
+
+    @_locked
+    def endBatch(self):
+        """Keep the batch's changes and flush the FAT clusters it touched."""
+        self._batchUndo = None
+        self._batchRefCounts = None
+        self.flushFatToDisk()
+
+    @_locked
+    def rollbackBatch(self):
+        """Undo every FAT change made since beginBatch()."""
+        undo = self._batchUndo
+        self._batchUndo = None
+        for clusterIndex, oldValue in reversed(undo):
+            self.setFatEntry(clusterIndex, oldValue)
+        self._refCounts, self._refCountsDirty, self._refTableStart = self._batchRefCounts
+        self._batchRefCounts = None
+        self.disk.sb_manager.refTableStart = self._refTableStart
+
+    def _inUseAtBatchStart(self):
+        """Return the clusters the open batch changed that were allocated when it began."""
+        if self._batchUndo is None:
+            return set()
+        first = {}
+        for clusterIndex, oldValue in self._batchUndo:
+            first.setdefault(clusterIndex, oldValue)
+        return {clusterIndex for clusterIndex, oldValue in first.items() if oldValue}
+
+    def _markAllFatDirty(self):
+        self._dirtyFatClusters.update(self._fatClusters())
+
+    def _rebuildFreeMap(self):
+        """Rebuild the free-cluster bitmap and free count from the FAT."""
+        # The FAT's last cluster may hold padding entries past the end of the disk
+        start, end = self.disk.content_start, self.disk.cluster_count
+        self._freeMap = bytearray(start) + bytearray(map(operator.not_, self.fat[start:end]))
+        self._freeCount = self._freeMap.count(1)
+        self._nextFreeHint = start
+        self._indexFreeRuns()
+
+    def _indexFreeRuns(self):
+        self._runLength, self._runEnd, self._runsByLength, self._runLengths = {}, {}, {}, []
+        freeMap = self._freeMap
+        start = freeMap.find(1, self.disk.content_start)
+        while start != -1:
+            end = freeMap.find(0, start)
+            if end == -1:
+                end = len(freeMap)
+            self._addRun(start, end - start)
+            start = freeMap.find(1, end)
+
+    def _addRun(self, start, length):
+        self._runLength[start] = length
+        self._runEnd[start + length] = start
+        starts = self._runsByLength.get(length)
+        if starts is None:
+            starts = self._runsByLength[length] = set()
+            bisect.insort(self._runLengths, length)
+        starts.add(start)
+
+    def _removeRun(self, start):
+        length = self._runLength.pop(start)
+        del self._runEnd[start + length]
+        starts = self._runsByLength[length]
+        starts.discard(start)
+        if not starts:
+            del self._runsByLength[length]
+            del self._runLengths[bisect.bisect_left(self._runLengths, length)]
+        return length
+
+    def _runAllocated(self, cluster):
+        """Split the free run holding cluster around it."""
+        start = cluster
+        if start not in self._runLength:
+            # Allocations usually take the first cluster of a run; otherwise find it
+            start = self._freeMap.rfind(0, 0, cluster) + 1
+        length = self._removeRun(start)
+        if cluster > start:
+            self._addRun(start, cluster - start)
+        if start + length > cluster + 1:
+            self._addRun(cluster + 1, start + length - cluster - 1)
+
+    def _runFreed(self, cluster):
+        """Add cluster to the free runs, merging it with its free neighbours."""
+        start, end = cluster, cluster + 1
+        if cluster in self._runEnd:
+            start = self._runEnd[cluster]
+            self._removeRun(start)
+        if end in self._runLength:
+            end += self._removeRun(end)
+        self._addRun(start, end - start)
+
+    def _ensureFreeMap(self):
+        if self._freeMap is None:
+            self._rebuildFreeMap()
+
+    def getFreeClusterCount(self):
+        return self._freeCount
 
     def getFatEntry(self, clusterIndex):
         return self.fat[clusterIndex]
     
+    @_locked
     def setFatEntry(self, clusterIndex, value):
+        oldValue = self.fat[clusterIndex]
         self.fat[clusterIndex] = value
+        if self._batchUndo is not None:
+            self._batchUndo.append((clusterIndex, oldValue))
+        head = self._chainOwner.get(clusterIndex)
+        if head is not None:
+            self._dropChain(head)
+        # Keep the free-space index in step with the FAT
+        if clusterIndex >= self.disk.content_start:
+            if oldValue == 0 and value != 0:
+                if self._freeMap is not None:
+                    self._freeMap[clusterIndex] = 0
+                    self._runAllocated(clusterIndex)
+                self._freeCount -= 1
+            elif oldValue != 0 and value == 0:
+                if self._freeMap is not None:
+                    self._freeMap[clusterIndex] = 1
+                    self._runFreed(clusterIndex)
+                self._freeCount += 1
+                if clusterIndex < self._nextFreeHint:
+                    self._nextFreeHint = clusterIndex
+        self._dirtyFatClusters.add(self.disk.fat_start + clusterIndex // self.entriesPerCluster)
 
     def readAllFat(self):
         return self.fat
             
     
+    @_locked
     def writeAllFat(self, fatData):
-        self.fat = fatData
+        self.fat = array('i', fatData)
+        self._markAllFatDirty()
+        self.clearChainCache()
+        self._rebuildFreeMap()
 
+    @_locked
     def followChain(self, startCluster):
+        """Return the clusters of the chain starting at startCluster, in order."""
+        return list(self._cachedChain(startCluster))
+
+    @_locked
+    def followChains(self, startClusters):
+        """Resolve many chains at once; returns {startCluster: cluster list}.
+
+        Chains already in the cache cost a copy; the rest are walked once and cached.
+        """
+        return {start: list(self._cachedChain(start)) for start in startClusters}
+
+    @_locked
+    def getChainTail(self, startCluster):
+        return self._cachedChain(startCluster)[-1]
+
+    @_locked
+    def clearChainCache(self):
+        self._chainCache = {}
+        self._chainOwner = {}
+
+    def _cachedChain(self, startCluster):
+        """The cached cluster list for a chain (do not modify), walking the FAT on a miss."""
+        chain = self._chainCache.get(startCluster)
+        if chain is None:
+            chain = self._walkChain(startCluster)
+            self._cacheChain(chain)
+        return chain
+
+    def _cacheChain(self, chain):
+        if len(chain) > self.maxCachedClusters:
+            return
+        owner = self._chainOwner
+        # A cluster may only be owned by one cached chain, and the cache stays bounded
+        for cluster in chain:
+            head = owner.get(cluster)
+            if head is not None:
+                self._dropChain(head)
+        while len(owner) + len(chain) > self.maxCachedClusters:
+            self._dropChain(next(iter(self._chainCache)))
+        head = chain[0]
+        self._chainCache[head] = chain
+        for cluster in chain:
+            owner[cluster] = head
+
+    def _dropChain(self, head):
+        owner = self._chainOwner
+        for cluster in self._chainCache.pop(head):
+            del owner[cluster]
+
+    def _walkChain(self, startCluster):
         clusterChain = []
-        if startCluster < 0 or startCluster >= FsConstants.CLUSTER_COUNT:
+        if startCluster < 0 or startCluster >= self.disk.cluster_count:
             raise IndexError("Cluster index out of range")
-        if startCluster <= 4:
+        if startCluster < self.disk.root_cluster:
             raise ValueError("Cannot follow reserved clusters")
+        contentStart, clusterCount = self.disk.content_start, self.disk.cluster_count
+        fat = self.fat
+        append = clusterChain.append
         currentCluster = startCluster
         
         while True:
-            clusterChain.append(currentCluster)
-            nextCluster = self.getFatEntry(currentCluster)
+            append(currentCluster)
+            nextCluster = fat[currentCluster]
             # Break on end-of-chain (-1) or free/uninitialized (0)
             if nextCluster == -1 or nextCluster == 0:
                 break
-            if nextCluster < 6 or nextCluster >= FsConstants.CLUSTER_COUNT:
+            if nextCluster < contentStart or nextCluster >= clusterCount:
                 break  # Invalid next cluster (reserved or out of range), treat as end
             currentCluster = nextCluster
         return clusterChain
 
-    def allocateChain (self, count):
-        allocatedClusters = []
-        for i in range(FsConstants.CONTENT_START_CLUSTER, FsConstants.CLUSTER_COUNT):
-            if len(allocatedClusters) == count:
-                break
-            if self.getFatEntry(i) == 0:
-                allocatedClusters.append(i)
-        if len(allocatedClusters) < count:
+    # zeroFill: pass False when the caller overwrites every allocated cluster,
+    # or never reads past the bytes it wrote (file data bounded by fileSize).
+    @_locked
+    def allocateChain (self, count, zeroFill=True):
+        self._ensureFreeMap()
+        if count < 1:
+            raise ValueError("Cluster count must be at least 1")
+        if count > self._freeCount:
             raise RuntimeError("Not enough free clusters available")
+        allocatedClusters = self._pickClusters(count)
         # Link clusters in the chain
         for j in range(len(allocatedClusters) - 1):
             self.setFatEntry(allocatedClusters[j], allocatedClusters[j + 1])
         # Mark end of chain
         self.setFatEntry(allocatedClusters[-1], -1)
+        self._advanceFreeHint()
         # Zero-initialize all allocated clusters
-        for cluster in allocatedClusters:
-            self.disk.write_cluster(cluster, b'\x00' * FsConstants.CLUSTER_SIZE)
+        if zeroFill:
+            for cluster in allocatedClusters:
+                self.disk.write_cluster(cluster, bytes(self.disk.cluster_size))
+        self._cacheChain(allocatedClusters)
         return allocatedClusters[0]  
+
+    @_locked
+    def findFreeRun(self, count):
+        """Return the first cluster of a free run of count clusters (best fit), or None. Allocates nothing."""
+        self._ensureFreeMap()
+        return self._findBestFitExtent(count)
+
+    @_locked
+    def reserveRun(self, startCluster, count):
+        """Allocate the free clusters startCluster .. startCluster + count - 1 as one chain."""
+        self._ensureFreeMap()
+        for cluster in range(startCluster, startCluster + count - 1):
+            self.setFatEntry(cluster, cluster + 1)
+        self.setFatEntry(startCluster + count - 1, -1)
+        self._advanceFreeHint()
+
+    def _pickClusters(self, count):
+        """Choose clusters for a new chain: best-fit contiguous run, else first-fit."""
+        start = self._findBestFitExtent(count)
+        if start is not None:
+            return list(range(start, start + count))
+        # No single run is large enough, take the first free clusters wherever they are
+        allocatedClusters = []
+        searchFrom = self._nextFreeHint
+        while len(allocatedClusters) < count:
+            i = self._freeMap.find(1, searchFrom)
+            allocatedClusters.append(i)
+            searchFrom = i + 1
+        return allocatedClusters
+
+    def _findBestFitExtent(self, count):
+        """Return the start of a smallest free run holding count clusters, or None."""
+        position = bisect.bisect_left(self._runLengths, count)
+        if position == len(self._runLengths):
+            return None
+        return next(iter(self._runsByLength[self._runLengths[position]]))
+
+    def _advanceFreeHint(self):
+        # Keep the invariant that every content cluster below the hint is in use
+        hint = self._freeMap.find(1, self._nextFreeHint)
+        self._nextFreeHint = hint if hint != -1 else len(self._freeMap)
     
-    def addClustersToChain(self, startCluster, additionalCount):
-        chain = self.followChain(startCluster)
+    @_locked
+    def addClustersToChain(self, startCluster, additionalCount, zeroFill=True):
+        self._ensureFreeMap()
+        if additionalCount < 1:
+            raise ValueError("Cluster count must be at least 1")
+        if additionalCount > self._freeCount:
+            raise RuntimeError("Not enough free clusters available")
+        chain = self._cachedChain(startCluster)
         lastCluster = chain[-1]
-        newClusters = self.allocateChain(additionalCount)
-        self.setFatEntry(lastCluster, newClusters)
+        # Grow in place when the clusters right after the tail are free
+        nextCluster = lastCluster + 1
+        if self._freeMap[nextCluster:nextCluster + additionalCount].count(1) == additionalCount:
+            for cluster in range(nextCluster, nextCluster + additionalCount - 1):
+                self.setFatEntry(cluster, cluster + 1)
+            self.setFatEntry(nextCluster + additionalCount - 1, -1)
+            self._advanceFreeHint()
+            if zeroFill:
+                for cluster in range(nextCluster, nextCluster + additionalCount):
+                    self.disk.write_cluster(cluster, bytes(self.disk.cluster_size))
+            newClusters = nextCluster
+            added = list(range(nextCluster, nextCluster + additionalCount))
+        else:
+            newClusters = self.allocateChain(additionalCount, zeroFill)
+            added = self.followChain(newClusters)
+        self._linkTail(startCluster, chain, added)
         return newClusters
+
+    def _linkTail(self, startCluster, chain, added):
+        """Point the tail of chain at added and extend the cached chain in place."""
+        cached = self._chainCache.get(startCluster) is chain
+        if cached:
+            # Only the tail's successor changes, so the cached list stays valid
+            del self._chainOwner[chain[-1]]
+            head = self._chainOwner.get(added[0])
+            if head is not None:
+                self._dropChain(head)
+        self.setFatEntry(chain[-1], added[0])
+        if cached:
+            self._chainOwner[chain[-1]] = startCluster
+            if len(self._chainOwner) + len(added) > self.maxCachedClusters:
+                self._dropChain(startCluster)
+                return
+            chain.extend(added)
+            for cluster in added:
+                self._chainOwner[cluster] = startCluster
+
+    @_locked
+    def relocateChain(self, startCluster):
+        """Copy a chain into one contiguous free run and free the old clusters.
+
+        Returns the new first cluster, or None when no free run is large enough.
+        The caller must point the owning directory entry at the new chain.
+        """
+        self._ensureFreeMap()
+        chain = self.followChain(startCluster)
+        count = len(chain)
+        newStart = self._findBestFitExtent(count)
+        if newStart is None:
+            return None
+        # Copy the data before touching the FAT so the old chain stays intact until the end
+        self._copyClusters(chain, range(newStart, newStart + count))
+        for cluster in range(newStart, newStart + count - 1):
+            self.setFatEntry(cluster, cluster + 1)
+        self.setFatEntry(newStart + count - 1, -1)
+        self.freeChain(startCluster)
+        self._advanceFreeHint()
+        return newStart
+
+    @staticmethod
+    def countRuns(chain):
+        """Number of contiguous runs in a cluster chain (1 means unfragmented)."""
+        if not chain:
+            return 0
+        runs = 1
+        for previous, current in zip(chain, chain[1:]):
+            if current != previous + 1:
+                runs += 1
+        return runs
+
+    @staticmethod
+    def extents(chain):
+        """Split a cluster chain into (firstCluster, length) runs of consecutive clusters."""
+        runs = []
+        for cluster in chain:
+            if runs and cluster == runs[-1][0] + runs[-1][1]:
+                runs[-1][1] += 1
+            else:
+                runs.append([cluster, 1])
+        return [tuple(run) for run in runs]
+
+    @_locked
+    def getChainRuns(self, startCluster):
+        return FATManager.countRuns(self.followChain(startCluster))
         
+    # ---------------------------------------------------------
+    # Shared chains. A cloned file points its directory entry at the source's
+    # chain instead of copying it; the chain's reference count says how many
+    # entries use it. Writers call unshareChain() first (copy-on-write) and
+    # drop their reference with freeChain() once their entry points at the
+    # copy; freeChain() only frees a shared chain when its last reference goes.
+    @_locked
+    def shareChain(self, startCluster):
+        """Add a reference to a chain for a new directory entry."""
+        self._refCounts[startCluster] = self._refCounts.get(startCluster, 1) + 1
+        self._refCountsDirty = True
+
+    def isShared(self, startCluster):
+        return startCluster in self._refCounts
+
+    def getRefCount(self, startCluster):
+        return self._refCounts.get(startCluster, 1)
+
+    def _releaseRef(self, startCluster):
+        refs = self._refCounts[startCluster] - 1
+        if refs > 1:
+            self._refCounts[startCluster] = refs
+        else:
+            del self._refCounts[startCluster]
+        self._refCountsDirty = True
+
+    @_locked
+    def unshareChain(self, startCluster, count=None):
+        """Give the caller a private copy of a shared chain and return its first cluster.
+
+        Only the first count clusters are copied (the whole chain by default).
+        The caller's reference to the shared chain is kept until it calls
+        freeChain(startCluster), which it does when its entry moves to the copy.
+        """
+        chain = self.followChain(startCluster)
+        if count is not None:
+            chain = chain[:max(1, count)]
+        newStart = self.allocateChain(len(chain), zeroFill=False)
+        self._copyClusters(chain, self.followChain(newStart))
+        return newStart
+
+    def _copyClusters(self, source, destination):
+        """Copy the data of the source clusters to the destination clusters, position by position.
+
+        Each read and write covers a stretch that is contiguous in both lists,
+        capped at COPY_BUFFER_BYTES, so memory use does not grow with the chain.
+        The destination must be free or newly allocated. Its data bypasses an
+        open batch, except in clusters the batch freed: a rollback gives those
+        back to their old owners.
+        """
+        inUse = self._inUseAtBatchStart()
+        step = max(1, FATManager.COPY_BUFFER_BYTES // self.disk.cluster_size)
+        position, total = 0, len(source)
+        while position < total:
+            first, target = source[position], destination[position]
+            length = 1
+            while (length < step and position + length < total
+                   and source[position + length] == first + length
+                   and destination[position + length] == target + length):
+                length += 1
+            bypass = inUse.isdisjoint(range(target, target + length))
+            self.disk.write_extent(target, self.disk.read_extent(first, length), bypass_batch=bypass)
+            position += length
+
+    def _loadRefCounts(self):
+        # Table layout: int32 entry count, then (first cluster, references) int32 pairs
+        self._refTableStart = self.disk.sb_manager.refTableStart
+        self._refCounts = {}
+        if not self._refTableStart:
+            return
+        data = b''.join(self.disk.view_cluster(cluster) for cluster in self.followChain(self._refTableStart))
+        count = struct.unpack_from('<i', data)[0]
+        values = struct.unpack_from(f'<{2 * count}i', data, FATManager.ENTRY_SIZE)
+        self._refCounts = dict(zip(values[0::2], values[1::2]))
+
+    def _flushRefCounts(self):
+        if not self._refCountsDirty:
+            return
+        values = [value for item in sorted(self._refCounts.items()) for value in item]
+        data = struct.pack(f'<i{len(values)}i', len(self._refCounts), *values)
+        needed = -(-len(data) // self.disk.cluster_size)
+        if not self._refTableStart:
+            self._refTableStart = self.allocateChain(needed, zeroFill=False)
+            self.disk.sb_manager.refTableStart = self._refTableStart
+            self.disk.sb_manager.save()
+        chain = self.followChain(self._refTableStart)
+        if needed > len(chain):
+            self.addClustersToChain(self._refTableStart, needed - len(chain), zeroFill=False)
+            chain = self.followChain(self._refTableStart)
+        cs = self.disk.cluster_size
+        for i, cluster in enumerate(chain[:needed]):
+            self.disk.write_cluster(cluster, data[i * cs:(i + 1) * cs], metadata=True)
+        self._refCountsDirty = False
+
+    @_locked
     def freeChain(self, startCluster):
+        if startCluster in self._refCounts:
+            # Other directory entries still use the chain
+            self._releaseRef(startCluster)
+            return
+        contentStart, clusterCount = self.disk.content_start, self.disk.cluster_count
         currentCluster = startCluster
         while True:
             nextCluster = self.getFatEntry(currentCluster)
             self.setFatEntry(currentCluster, 0)  # Mark as free
-            if nextCluster == -1:
+            # Stop on end-of-chain, or on a broken link that would reach reserved clusters
+            if nextCluster < contentStart or nextCluster >= clusterCount:
                 break
             currentCluster = nextCluster
 
@@ -113,19 +604,15 @@ class FATManager:
         if self.getFatEntry(0) == 0:
             self.setFatEntry(0, -1)
         
-        # Clusters 1-4: FAT chain
-        if self.getFatEntry(1) == 0:
-            self.setFatEntry(1, 2)
-        if self.getFatEntry(2) == 0:
-            self.setFatEntry(2, 3)
-        if self.getFatEntry(3) == 0:
-            self.setFatEntry(3, 4)
-        if self.getFatEntry(4) == 0:
-            self.setFatEntry(4, -1)
+        # FAT clusters form one chain
+        fatStart, fatEnd = self.disk.fat_start, self.disk.fat_end
+        for cluster in range(fatStart, fatEnd + 1):
+            if self.getFatEntry(cluster) == 0:
+                self.setFatEntry(cluster, cluster + 1 if cluster < fatEnd else -1)
         
-        # Cluster 5: Root directory (reserved)
-        if self.getFatEntry(5) == 0:
-            self.setFatEntry(5, -1)
+        # Root directory (reserved)
+        if self.getFatEntry(self.disk.root_cluster) == 0:
+            self.setFatEntry(self.disk.root_cluster, -1)
         
         # Flush the initialized FAT to disk
         self.flushFatToDisk()
@@ -0,0 +1,285 @@
+import os
+from Directory import DirectoryEntry
+
+
+class FileHandle:
+    """File-object style access to a single file on the virtual disk.
+
+    The cluster chain is walked lazily from the current position, so memory
+    use stays flat however large the file is. All data is bytes.
+    Directory entry and FAT changes are written on flush() and close().
+    Writes fail with IOError once another writer has deleted the file or
+    replaced its entry, since the handle's chain may then be free or reused.
+    """
+
+    MODES = ("r", "r+", "w", "w+", "a", "a+")
+
+    def __init__(self, fileSystem, parentCluster, entry, mode):
+        self.fs = fileSystem
+        self.disk = fileSystem.disk
+        self.clusterSize = fileSystem.disk.cluster_size
+        self.fat = fileSystem.fat
+        self.parentCluster = parentCluster
+        self.name = entry.name
+        self.attr = entry.attr
+        self.firstCluster = entry.firstCluster
+        self.size = entry.fileSize
+        # (first cluster, size) of the directory entry as this handle last saw it
+        self._entry = (entry.firstCluster, entry.fileSize)
+        self.mode = mode
+        self.closed = False
+        self._pos = 0
+        self._dirty = False
+        # Lazy chain cursor: the chain index and cluster number last visited
+        self._cursorIndex = 0
+        self._cursorCluster = entry.firstCluster
+
+    # ---------------------------------------------------------
+    def __enter__(self):
+        return self
+
+    def __exit__(self, excType, excValue, traceback):
+        self.close()
+
+    def readable(self):
+        return self.mode.startswith("r") or "+" in self.mode
+
+    def writable(self):
+        return self.mode != "r"
+
+    def _checkOpen(self):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+
+    def _checkEntry(self):
+        """Raise IOError if the file's entry changed since this handle last saw it.
+
+        Call with the parent directory locked.
+        """
+        de = self.fs.directory.findDirectoryEntry(self.parentCluster, self.name)
+        if de is None or (de.firstCluster, de.fileSize) != self._entry:
+            raise IOError("File was changed or deleted since it was opened")
+
+    # ---------------------------------------------------------
+    def _chainLength(self):
+        # Files always own at least one cluster, and never more than their size needs
+        return max(1, (self.size + self.clusterSize - 1) // self.clusterSize)
+
+    def _clusterAt(self, index):
+        """Return the cluster holding chain position index, walking from the cursor."""
+        if index < self._cursorIndex:
+            self._cursorIndex = 0
+            self._cursorCluster = self.firstCluster
+        while self._cursorIndex < index:
+            self._cursorCluster = self.fat.getFatEntry(self._cursorCluster)
+            self._cursorIndex += 1
+        return self._cursorCluster
+
+    def _runFrom(self, index, limit):
+        """Return (cluster, length) for the run of consecutive clusters at chain position index.
+
+        The run is at most limit clusters long; the cursor is left on its last cluster.
+        """
+        first = self._clusterAt(index)
+        length = 1
+        while length < limit and self.fat.getFatEntry(self._cursorCluster) == self._cursorCluster + 1:
+            self._cursorCluster += 1
+            self._cursorIndex += 1
+            length += 1
+        return first, length
+
+    def _ensureClusters(self, count):
+        """Grow the chain so it holds at least count clusters."""
+        current = self._chainLength()
+        if count > current:
+            # Bytes between the old size and a write are zero-filled by write()
+            self.fat.addClustersToChain(self.firstCluster, count - current, zeroFill=False)
+
+    # ---------------------------------------------------------
+    def tell(self):
+        self._checkOpen()
+        return self._pos
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        self._checkOpen()
+        if whence == os.SEEK_SET:
+            newPos = offset
+        elif whence == os.SEEK_CUR:
+            newPos = self._pos + offset
+        elif whence == os.SEEK_END:
+            newPos = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if newPos < 0:
+            raise ValueError("Negative seek position")
+        self._pos = newPos
+        return newPos
+
+    # ---------------------------------------------------------
+    def readinto(self, buffer):
+        """Read up to len(buffer) bytes into buffer and return the count read."""
+        self._checkOpen()
+        if not self.readable():
+            raise IOError("File not open for reading")
+
+        target = memoryview(buffer).cast("B")
+        total = min(len(target), max(0, self.size - self._pos))
+        done = 0
+        while done < total:
+            index, offset = divmod(self._pos, self.clusterSize)
+            # Contiguous clusters are read with a single extent read
+            first, length = self._runFrom(index, -(-(offset + total - done) // self.clusterSize))
+            count = min(length * self.clusterSize - offset, total - done)
+            if length == 1:
+                view = self.disk.view_cluster(first)
+            else:
+                view = memoryview(self.disk.read_extent(first, length))
+            target[done:done + count] = view[offset:offset + count]
+            done += count
+            self._pos += count
+        return done
+
+    def read(self, n=-1):
+        """Read up to n bytes (everything up to end of file when n is negative)."""
+        self._checkOpen()
+        remaining = max(0, self.size - self._pos)
+        if n is None or n < 0 or n > remaining:
+            n = remaining
+        buffer = bytearray(n)
+        count = self.readinto(buffer)
+        return bytes(buffer[:count])
+
+    # ---------------------------------------------------------
+    def write(self, data):
+        """Write bytes at the current position (at end of file in append mode)."""
+        self._checkOpen()
+        if not self.writable():
+            raise IOError("File not open for writing")
+
+        data = memoryview(data.encode("utf-8") if isinstance(data, str) else data).cast("B")
+        # Keep these writes out of another thread's open transaction, and keep
+        # readers of the parent directory from seeing the file half written
+        with self.fs.transactionLock, self.fs.lockDirectories([self.parentCluster]):
+            self._checkEntry()
+            if self.mode.startswith("a"):
+                self._pos = self.size
+            if not data:
+                return 0
+            if self._pos > self.size:
+                # Writing past the end leaves a hole, which reads back as zeros
+                self._zeroFill(self.size, self._pos)
+            self._writeAt(self._pos, data)
+            self._pos += len(data)
+            return len(data)
+
+    def _writeAt(self, position, data):
+        if self.fat.isShared(self.firstCluster):
+            self._unshare()
+        end = position + len(data)
+        self._ensureClusters((end + self.clusterSize - 1) // self.clusterSize)
+        done = 0
+        while done < len(data):
+            index, offset = divmod(position + done, self.clusterSize)
+            count = min(self.clusterSize - offset, len(data) - done)
+            if count == self.clusterSize:
+                # Whole clusters: one extent write per contiguous run
+                first, length = self._runFrom(index, (len(data) - done) // self.clusterSize)
+                count = length * self.clusterSize
+                self.disk.write_extent(first, data[done:done + count])
+            else:
+                # Partial cluster: read-modify-write only this cluster
+                cluster = self._clusterAt(index)
+                clusterData = bytearray(self.disk.read_cluster(cluster))
+                clusterData[offset:offset + count] = data[done:done + count]
+                self.disk.write_cluster(cluster, clusterData)
+            done += count
+        if end > self.size:
+            self.size = end
+        self._dirty = True
+
+    def _unshare(self, count=None):
+        """Copy-on-write: move this file onto a private copy of its shared chain."""
+        self.firstCluster = self.fat.unshareChain(self.firstCluster, count)
+        self._cursorIndex = 0
+        self._cursorCluster = self.firstCluster
+        self._dirty = True
+
+    def _zeroFill(self, start, end):
+        # Fill one cluster-sized piece at a time so large holes stay cheap in memory
+        zeros = bytes(self.clusterSize)
+        while start < end:
+            count = min(end - start, self.clusterSize - start % self.clusterSize)
+            self._writeAt(start, zeros[:count])
+            start += count
+
+    # ---------------------------------------------------------
+    def truncate(self, size=None):
+        """Resize the file to size bytes (default: current position)."""
+        self._checkOpen()
+        if not self.writable():
+            raise IOError("File not open for writing")
+
+        if size is None:
+            size = self._pos
+        if size < 0:
+            raise ValueError("Negative size")
+
+        with self.fs.transactionLock, self.fs.lockDirectories([self.parentCluster]):
+            self._checkEntry()
+            if size > self.size:
+                self._zeroFill(self.size, size)
+            elif size < self.size:
+                keep = max(1, (size + self.clusterSize - 1) // self.clusterSize)
+                if self.fat.isShared(self.firstCluster):
+                    # Only the clusters that are kept need copying
+                    self._unshare(keep)
+                elif keep < self._chainLength():
+                    tail = self._clusterAt(keep - 1)
+                    nextCluster = self.fat.getFatEntry(tail)
+                    self.fat.setFatEntry(tail, -1)
+                    self.fat.freeChain(nextCluster)
+                    if self._cursorIndex >= keep:
+                        self._cursorIndex = 0
+                        self._cursorCluster = self.firstCluster
+                self.size = size
+                self._dirty = True
+        return size
+
+    # ---------------------------------------------------------
+    def flush(self):
+        """Write the updated size and chain to the directory entry and FAT."""
+        self._checkOpen()
+        if not self._dirty:
+            return
+        entry = DirectoryEntry(self.name, self.attr, self.firstCluster, self.size)
+        with self.fs.transactionLock, self.fs.lockDirectories([self.parentCluster]):
+            try:
+                self._checkEntry()
+            except IOError:
+                self._discard()
+                raise
+            with self.fs.batch():
+                self.fs.directory.updateDirectoryEntry(self.parentCluster, self.name, entry)
+                if self.firstCluster != self._entry[0]:
+                    # The entry moved to the private copy: drop its reference to the shared chain
+                    self.fat.freeChain(self._entry[0])
+                self.fat.flushFatToDisk()
+        self._entry = (self.firstCluster, self.size)
+        self._dirty = False
+
+    def _discard(self):
+        """Drop unflushed changes; a private copy made by _unshare() has no other owner."""
+        if self.firstCluster != self._entry[0]:
+            with self.fs.batch():
+                self.fat.freeChain(self.firstCluster)
+                self.fat.flushFatToDisk()
+            self.firstCluster = self._entry[0]
+        self._dirty = False
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self.flush()
+        finally:
+            self.closed = True
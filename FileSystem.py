@@ -1,5 +1,34 @@
+import fnmatch
+import functools
+import inspect
+import threading
+from contextlib import contextmanager, ExitStack
 from Directory import DirectoryEntry, Directory
-from FsConstants import FsConstants
+from FATManager import FATManager
+from FileHandle import FileHandle
+from DentryCache import DentryCache
+from RWLock import RWLock
+
+
+def _transaction(*directoryParams):
+    """Run a FileSystem operation as one batch, so its metadata commits atomically.
+
+    directoryParams name the arguments holding the clusters of directories the
+    operation changes; those directories are write-locked while it runs.
+    """
+    def decorator(method):
+        params = list(inspect.signature(method).parameters)[1:]
+        positions = [(params.index(name), name) for name in directoryParams]
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            clusters = [args[i] if i < len(args) else kwargs[name] for i, name in positions]
+            # The batch commits before the directory locks are released, so
+            # readers never see the directories without the committed changes
+            with self.transactionLock, self.lockDirectories(clusters), self.batch():
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
 
 
 class FileSystem:
@@ -7,17 +36,85 @@ class FileSystem:
         self.disk = disk
         self.fat = fatManager
         self.directory = directory
+        self.dentryCache = DentryCache(directory, disk.root_cluster)
+        self._batchDepth = 0
+        # Locking, always taken in this order: the transaction lock (held for a
+        # whole batch, so one thread writes at a time), then directory locks in
+        # cluster order, then the FAT and disk locks inside those managers.
+        # Readers only take directory read locks, so they run alongside each
+        # other and alongside a writer working in other directories.
+        self.transactionLock = threading.RLock()
+        self._directoryLocks = {}  # directory first cluster -> RWLock
+        self._directoryLocksGuard = threading.Lock()
+
+    def _directoryLock(self, cluster):
+        with self._directoryLocksGuard:
+            lock = self._directoryLocks.get(cluster)
+            if lock is None:
+                lock = self._directoryLocks[cluster] = RWLock()
+            return lock
+
+    @contextmanager
+    def lockDirectories(self, clusters, write=True):
+        """Hold the read or write locks of several directories, taken in cluster order."""
+        with ExitStack() as stack:
+            for cluster in sorted(set(clusters)):
+                lock = self._directoryLock(cluster)
+                stack.enter_context(lock.write() if write else lock.read())
+            yield
+
+    @contextmanager
+    def batch(self):
+        """Group operations into one transaction: `with fs.batch(): ...`
 
+        FAT, directory and data writes are staged in memory and committed in
+        cluster order with a single flush when the outermost block exits. If
+        the block raises, nothing is written and the in-memory FAT and
+        directory caches are rolled back.
+        """
+        # Held for the whole transaction: staged writes belong to one thread at a time
+        with self.transactionLock:
+            if self._batchDepth:
+                # Nested blocks join the enclosing transaction
+                self._batchDepth += 1
+                try:
+                    yield self
+                finally:
+                    self._batchDepth -= 1
+                return
+
+            self._batchDepth = 1
+            self.disk.begin_batch()
+            self.fat.beginBatch()
+            try:
+                yield self
+            except BaseException:
+                self.disk.discard_batch()
+                self.fat.rollbackBatch()
+                self.directory.invalidate()
+                self.dentryCache.clear()
+                raise
+            else:
+                # Stage the FAT clusters the batch touched, then commit everything at once
+                self.fat.endBatch()
+                self.disk.commit_batch()
+            finally:
+                self._batchDepth = 0
+
+    @_transaction("parentCluster")
     def createFile(self, parentCluster, fileName):
         """Create a new file in the specified parent directory."""
+        if not Directory.isValidName(fileName):
+            print("Invalid name")
+            return False
         # Search for duplicates
         de = self.directory.findDirectoryEntry(parentCluster, fileName)
         if de:
             print("A file with that name already exists")
             return False
         
-        # Allocate a cluster for the new file
-        newCluster = self.fat.allocateChain(1)
+        # Allocate a cluster for the new file; nothing past fileSize is ever read
+        newCluster = self.fat.allocateChain(1, zeroFill=False)
         # Add file entry
         de = DirectoryEntry(fileName, 0x00, newCluster, 0)  # 0x00 = file attribute
         self.directory.addDirectoryEntry(parentCluster, de)
@@ -25,6 +122,7 @@ class FileSystem:
         self.fat.flushFatToDisk()
         return True
 
+    @_transaction("parentCluster")
     def writeFile(self, parentCluster, fileName, data):
         """Write data to an existing file."""
         de = self.directory.findDirectoryEntry(parentCluster, fileName)
@@ -36,43 +134,103 @@ class FileSystem:
         dataBytes = data.encode('utf-8') if isinstance(data, str) else data
         
         # Calculate clusters needed (minimum 1)
-        clustersNeeded = max(1, (len(dataBytes) + FsConstants.CLUSTER_SIZE - 1) // FsConstants.CLUSTER_SIZE)
+        clustersNeeded = max(1, (len(dataBytes) + self.disk.cluster_size - 1) // self.disk.cluster_size)
         
         # Free old chain and allocate new one
         self.fat.freeChain(de.firstCluster)
-        newFirst = self.fat.allocateChain(clustersNeeded)
+        newFirst = self.fat.allocateChain(clustersNeeded, zeroFill=False)
         
         # Write data to clusters
-        chain = self.fat.followChain(newFirst)
-        for i, cluster in enumerate(chain):
-            start = i * FsConstants.CLUSTER_SIZE
-            end = start + FsConstants.CLUSTER_SIZE
-            chunk = dataBytes[start:end]
-            self.disk.write_cluster(cluster, chunk)
-        
-        # Update directory entry with new cluster and size (remove and reenter)
-        self.directory.removeDirectoryEntry(parentCluster, fileName)
-        updatedEntry = DirectoryEntry(fileName, de.attr, newFirst, len(dataBytes))
-        self.directory.addDirectoryEntry(parentCluster, updatedEntry)
+        self._writeChainData(newFirst, dataBytes)
+        
+        # Update directory entry with new cluster and size in its existing slot
+        updatedEntry = DirectoryEntry(de.name, de.attr, newFirst, len(dataBytes))
+        self.directory.updateDirectoryEntry(parentCluster, de.name, updatedEntry)
         self.fat.flushFatToDisk()
         return True
 
-    def readFile(self, parentCluster, fileName):
-        """Read and return the contents of a file."""
+    def _writeChainData(self, firstCluster, data):
+        """Write data over a chain, one extent write per contiguous run."""
+        chain = self.fat.followChain(firstCluster)
+        offset = 0
+        for start, count in FATManager.extents(chain):
+            end = offset + count * self.disk.cluster_size
+            self.disk.write_extent(start, data[offset:end])
+            offset = end
+
+    def appendFile(self, parentCluster, fileName, data):
+        """Append data to an existing file, touching only its tail cluster(s)."""
+        return self.writeFileAt(parentCluster, fileName, None, data)
+
+    @_transaction("parentCluster")
+    def writeFileAt(self, parentCluster, fileName, offset, data):
+        """Write data at a byte offset of an existing file (None appends at the end)."""
         de = self.directory.findDirectoryEntry(parentCluster, fileName)
         if not de:
             print("File not found")
+            return False
+        if de.attr != 0x00:
+            print("Cannot write to a directory")
+            return False
+
+        with FileHandle(self, parentCluster, de, "r+") as handle:
+            handle.seek(de.fileSize if offset is None else offset)
+            handle.write(data)
+        return True
+
+    def open(self, parentCluster, fileName, mode="r"):
+        """Open a file and return a FileHandle, or None if it cannot be opened.
+
+        Modes: 'r' read, 'r+' read/write, 'w'/'w+' truncate (creating the file if
+        needed), 'a'/'a+' append (creating the file if needed). A 'b' suffix is
+        accepted and ignored; handles always work with bytes.
+        """
+        mode = mode.replace("b", "")
+        if mode not in FileHandle.MODES:
+            raise ValueError(f"Invalid mode: {mode}")
+
+        with self.lockDirectories([parentCluster], write=False):
+            de = self.directory.findDirectoryEntry(parentCluster, fileName)
+        if not de:
+            if mode.startswith("r"):
+                print("File not found")
+                return None
+            if not self.createFile(parentCluster, fileName):
+                return None
+            with self.lockDirectories([parentCluster], write=False):
+                de = self.directory.findDirectoryEntry(parentCluster, fileName)
+
+        if de.attr != 0x00:
+            print("Cannot open a directory")
             return None
-        
-        # Follow cluster chain and read data
-        chain = self.fat.followChain(de.firstCluster)
-        data = b''
-        for cluster in chain:
-            data += self.disk.read_cluster(cluster)
-        
-        # Trim to actual file size and decode
-        return data[:de.fileSize].decode('utf-8', errors='ignore')
 
+        handle = FileHandle(self, parentCluster, de, mode)
+        if mode.startswith("w") and de.fileSize:
+            handle.truncate(0)
+        return handle
+
+    def readFileBytes(self, parentCluster, fileName):
+        """Read and return the raw contents of a file as bytes."""
+        with self.lockDirectories([parentCluster], write=False):
+            handle = self.open(parentCluster, fileName, "r")
+            if handle is None:
+                return None
+            with handle:
+                return handle.read()
+
+    def listDirectory(self, directoryCluster):
+        """Return the entries of a directory."""
+        with self.lockDirectories([directoryCluster], write=False):
+            return self.directory.readDirectoryEntry(directoryCluster)
+
+    def readFile(self, parentCluster, fileName):
+        """Read and return the contents of a file."""
+        data = self.readFileBytes(parentCluster, fileName)
+        if data is None:
+            return None
+        return data.decode('utf-8', errors='ignore')
+
+    @_transaction("parentCluster")
     def deleteFile(self, parentCluster, fileName):
         """Delete a file from the specified directory."""
         de = self.directory.findDirectoryEntry(parentCluster, fileName)
@@ -90,8 +248,12 @@ class FileSystem:
         self.fat.flushFatToDisk()
         return True
 
+    @_transaction("directoryCluster")
     def renameEntry(self, directoryCluster, oldName, newName):
         """Rename a file or directory."""
+        if not Directory.isValidName(newName):
+            print("Invalid name")
+            return False
         # Check if new name already exists
         existing = self.directory.findDirectoryEntry(directoryCluster, newName)
         if existing:
@@ -104,15 +266,27 @@ class FileSystem:
             print("File not found")
             return False
         
-        # Remove old entry and add with new name
-        self.directory.removeDirectoryEntry(directoryCluster, oldName)
+        self.dentryCache.invalidate(directoryCluster, oldName)
+        # Rewrite the entry with its new name in the same slot
         renamedEntry = DirectoryEntry(newName, de.attr, de.firstCluster, de.fileSize)
-        self.directory.addDirectoryEntry(directoryCluster, renamedEntry)
+        self.directory.updateDirectoryEntry(directoryCluster, oldName, renamedEntry)
         self.fat.flushFatToDisk()
         return True
 
+    @_transaction("sourceCluster", "destCluster")
     def copyFile(self, sourceCluster, sourceName, destCluster, destName):
-        """Copy a file to a destination."""
+        """Copy a file to a destination.
+
+        The copy is a clone: it shares the source's clusters, and whichever file
+        is written first gets its own copy of the data (copy-on-write). Sharing
+        is per chain, so that first write copies the whole file (only the kept
+        part for a truncate), however small the write is: a 1-byte append to a
+        cloned 1 GB file writes 1 GB. The copy streams through a bounded
+        buffer, so memory use stays flat.
+        """
+        if not Directory.isValidName(destName):
+            print("Invalid name")
+            return False
         # Read source file
         de = self.directory.findDirectoryEntry(sourceCluster, sourceName)
         if not de:
@@ -129,40 +303,189 @@ class FileSystem:
             print("Destination file already exists")
             return False
         
-        # Read source data
-        chain = self.fat.followChain(de.firstCluster)
-        data = b''
-        for cluster in chain:
-            data += self.disk.read_cluster(cluster)
-        data = data[:de.fileSize]
-        
-        # Calculate clusters needed
-        clustersNeeded = max(1, (len(data) + FsConstants.CLUSTER_SIZE - 1) // FsConstants.CLUSTER_SIZE)
-        
-        # Allocate clusters for destination
-        newCluster = self.fat.allocateChain(clustersNeeded)
-        
-        # Write data to clusters
-        for i, cluster in enumerate(self.fat.followChain(newCluster)):
-            start = i * FsConstants.CLUSTER_SIZE
-            end = start + FsConstants.CLUSTER_SIZE
-            chunk = data[start:end]
-            self.disk.write_cluster(cluster, chunk)
-        
-        # Create destination entry directly
-        destEntry = DirectoryEntry(destName, 0x00, newCluster, len(data))
+        # Share the source chain instead of copying its data
+        self.fat.shareChain(de.firstCluster)
+        destEntry = DirectoryEntry(destName, 0x00, de.firstCluster, de.fileSize)
         self.directory.addDirectoryEntry(destCluster, destEntry)
         self.fat.flushFatToDisk()
         return True
 
+    @_transaction("sourceCluster", "destCluster")
     def moveFile(self, sourceCluster, sourceName, destCluster, destName):
-        """Move a file to a destination (copy then delete source)."""
-        if self.copyFile(sourceCluster, sourceName, destCluster, destName):
-            return self.deleteFile(sourceCluster, sourceName)
-        return False
+        """Move a file to a destination by relinking its directory entry; no data is copied."""
+        if not Directory.isValidName(destName):
+            print("Invalid name")
+            return False
+        de = self.directory.findDirectoryEntry(sourceCluster, sourceName)
+        if not de:
+            print("Source file not found")
+            return False
 
+        if de.attr != 0x00:
+            print("Cannot move a directory. Use a file.")
+            return False
+
+        if self.directory.findDirectoryEntry(destCluster, destName):
+            print("Destination file already exists")
+            return False
+
+        self.directory.addDirectoryEntry(destCluster, DirectoryEntry(destName, de.attr, de.firstCluster, de.fileSize))
+        self.dentryCache.invalidate(sourceCluster, sourceName)
+        self.directory.removeDirectoryEntry(sourceCluster, sourceName)
+        self.fat.flushFatToDisk()
+        return True
+
+    @_transaction("parentCluster")
+    def deleteTree(self, parentCluster, name):
+        """Delete a file, or a directory and everything below it, in one transaction."""
+        de = self.directory.findDirectoryEntry(parentCluster, name)
+        if not de:
+            print("File not found")
+            return False
+        if de.attr != 0x01:
+            return self.deleteFile(parentCluster, name)
+
+        directories = [de.firstCluster]
+        files = []
+        for _, entry in self.directory.walkTree(de.firstCluster):
+            (directories if entry.attr == 0x01 else files).append(entry.firstCluster)
+
+        # Entries inside the tree go away with their directories' clusters;
+        # the FAT changes are flushed once, when the transaction commits
+        with self.lockDirectories(directories):
+            for firstCluster in files:
+                self.fat.freeChain(firstCluster)
+            for cluster in directories:
+                self.directory.freeIndex(cluster)
+                self.fat.freeChain(cluster)
+                self.directory.invalidate(cluster)
+        self.dentryCache.invalidate(parentCluster, name)
+        self.directory.removeDirectoryEntry(parentCluster, name)
+        self.fat.flushFatToDisk()
+        return True
+
+    @_transaction("destCluster")
+    def copyTree(self, sourceCluster, sourceName, destCluster, destName):
+        """Copy a file, or a directory and everything below it, in one transaction.
+
+        Directories are recreated; files are cloned, so no file data is copied.
+        """
+        de = self.directory.findDirectoryEntry(sourceCluster, sourceName)
+        if not de:
+            print("Source file not found")
+            return False
+        if de.attr != 0x01:
+            return self.copyFile(sourceCluster, sourceName, destCluster, destName)
+
+        if self.directory.findDirectoryEntry(destCluster, destName):
+            print("Destination file already exists")
+            return False
+        tree = list(self.directory.walkTree(de.firstCluster))
+        if destCluster == de.firstCluster or any(
+            entry.attr == 0x01 and entry.firstCluster == destCluster for _, entry in tree
+        ):
+            print("Cannot copy a directory into itself")
+            return False
+
+        if not self.createDirectory(destCluster, destName):
+            return False
+        # Source directory cluster -> its copy; the walk visits parents first
+        copies = {de.firstCluster: self.directory.findDirectoryEntry(destCluster, destName).firstCluster}
+        for parent, entry in tree:
+            target = copies[parent]
+            if entry.attr == 0x01:
+                self.createDirectory(target, entry.name)
+                copies[entry.firstCluster] = self.directory.findDirectoryEntry(target, entry.name).firstCluster
+            else:
+                self.copyFile(parent, entry.name, target, entry.name)
+        self.fat.flushFatToDisk()
+        return True
+
+    def diskUsage(self, parentCluster, name=None):
+        """Return file, directory, byte and cluster totals for an entry and everything below it.
+
+        With no name, totals the contents of directory parentCluster. Chains
+        shared by cloned files are counted once.
+        """
+        # Writers all go through transactionLock, so holding it gives a stable tree
+        with self.transactionLock:
+            return self._diskUsage(parentCluster, name)
+
+    def _diskUsage(self, parentCluster, name):
+        totals = {"files": 0, "directories": 0, "bytes": 0, "clusters": 0}
+        seen = set()
+
+        def countChain(firstCluster):
+            if firstCluster not in seen:
+                seen.add(firstCluster)
+                totals["clusters"] += len(self.fat.followChain(firstCluster))
+
+        root = parentCluster
+        if name is not None:
+            de = self.directory.findDirectoryEntry(parentCluster, name)
+            if not de:
+                print("File not found")
+                return None
+            countChain(de.firstCluster)
+            if de.attr != 0x01:
+                totals["files"] = 1
+                totals["bytes"] = de.fileSize
+                return totals
+            totals["directories"] = 1
+            root = de.firstCluster
+
+        for _, entry in self.directory.walkTree(root):
+            if entry.attr == 0x01:
+                totals["directories"] += 1
+            else:
+                totals["files"] += 1
+                totals["bytes"] += entry.fileSize
+            countChain(entry.firstCluster)
+        return totals
+
+    def find(self, directoryCluster, name=None, entryType=None, minSize=None, maxSize=None,
+             maxDepth=None, prune=None):
+        """Yield (path, entry) for every entry below a directory that matches all the filters.
+
+        name and prune are glob patterns matched against entry names, ignoring
+        case; directories matching prune are not entered. entryType is 'f'
+        for files or 'd' for directories, and the size bounds (in bytes,
+        inclusive) apply to files only. Results stream as the tree is read,
+        so like os.walk this is not a snapshot of a tree that is changing.
+        """
+        name = name.upper() if name else None
+        prune = prune.upper() if prune else None
+        descend = (lambda path, de: not fnmatch.fnmatchcase(de.name, prune)) if prune else None
+        for path, de in self.directory.walk(directoryCluster, maxDepth, descend):
+            isDirectory = de.attr == 0x01
+            if entryType is not None and entryType != ("d" if isDirectory else "f"):
+                continue
+            if (minSize is not None or maxSize is not None) and (
+                isDirectory
+                or (minSize is not None and de.fileSize < minSize)
+                or (maxSize is not None and de.fileSize > maxSize)
+            ):
+                continue
+            if name is not None and not fnmatch.fnmatchcase(de.name, name):
+                continue
+            yield path, de
+
+    def getFragmentation(self, parentCluster, name):
+        """Return (clusters, runs) for an entry's cluster chain, or None if not found."""
+        with self.lockDirectories([parentCluster], write=False):
+            de = self.directory.findDirectoryEntry(parentCluster, name)
+            if not de:
+                print("File not found")
+                return None
+            chain = self.fat.followChain(de.firstCluster)
+        return (len(chain), FATManager.countRuns(chain))
+
+    @_transaction("parentCluster")
     def createDirectory(self, parentCluster, dirName):
         """Create a new directory."""
+        if not Directory.isValidName(dirName):
+            print("Invalid name")
+            return False
         de = self.directory.findDirectoryEntry(parentCluster, dirName)
         if de:
             print("Directory already exists")
@@ -170,12 +493,15 @@ class FileSystem:
         
         # Allocate a cluster for the new directory
         newCluster = self.fat.allocateChain(1)
+        # The cluster may have belonged to a directory that was cached before
+        self.directory.invalidate(newCluster)
         de = DirectoryEntry(dirName, 0x01, newCluster, 0)
         self.directory.addDirectoryEntry(parentCluster, de)
         
         self.fat.flushFatToDisk()
         return True
 
+    @_transaction("parentCluster")
     def deleteDirectory(self, parentCluster, dirName):
         """Delete an empty directory."""
         de = self.directory.findDirectoryEntry(parentCluster, dirName)
@@ -188,13 +514,18 @@ class FileSystem:
             print("Not a directory. Use rm for files.")
             return False
         
-        # Check if directory is empty
-        entries = self.directory.readDirectoryEntry(de.firstCluster)
-        if entries:
-            print("Directory not empty")
-            return False
-        
-        self.fat.freeChain(de.firstCluster)
+        # Keep readers out of the directory while it is checked and freed
+        with self.lockDirectories([de.firstCluster]):
+            # Check if directory is empty
+            entries = self.directory.readDirectoryEntry(de.firstCluster)
+            if entries:
+                print("Directory not empty")
+                return False
+            
+            self.directory.freeIndex(de.firstCluster)
+            self.fat.freeChain(de.firstCluster)
+            self.directory.invalidate(de.firstCluster)
+        self.dentryCache.invalidate(parentCluster, dirName)
         self.directory.removeDirectoryEntry(parentCluster, dirName)
         self.fat.flushFatToDisk()
         return True
@@ -1,5 +1,6 @@
 class FsConstants:
-    # File system related constants
+    # File system related constants. The geometry values are the defaults for
+    # new disks; a formatted disk records its own geometry in the superblock.
     CLUSTER_SIZE = 1024  # Size of a cluster in bytes
     CLUSTER_COUNT = 1024  # Total number of clusters in the virtual disk
     SUPERBLOCK_CLUSTER = 0  # Cluster index for the superblock
@@ -7,4 +8,8 @@ class FsConstants:
     FAT_END_CLUSTER = 4  # Ending cluster index for the FAT
     ROOT_DIR_FIRST_CLUSTER = 5  # First cluster index for the root directory
     CONTENT_START_CLUSTER = 6  # Starting cluster index for file content
-    
\ No newline at end of file
+    JOURNAL_CLUSTERS = 64  # Clusters reserved for the metadata journal
+    MIN_JOURNAL_CLUSTERS = 16  # Smaller disks get a journal of about 1/32 of their content, down to this
+    MIN_CLUSTER_SIZE = 512  # Smallest cluster size accepted at format time
+    MAX_CLUSTER_SIZE = 65536  # Largest cluster size accepted at format time
+    MAX_CLUSTER_COUNT = 2**31 - 1  # FAT entries are signed int32
@@ -0,0 +1,184 @@
+import struct
+import zlib
+from FsConstants import FsConstants
+
+
+class Journal:
+    """Write-ahead journal for metadata clusters (FAT, directories, superblock).
+
+    The journal is a contiguous run of clusters recorded in the superblock.
+    Its first cluster is a header; transactions are appended after it, each
+    as a descriptor cluster followed by the new images of the clusters it
+    changes. A transaction is durable once its log records are synced; the
+    images are copied to their home clusters lazily, and any log records not
+    yet checkpointed are replayed when the disk is next opened.
+    """
+
+    MAGIC = b'VFSJRNL\x00'
+    TXN_MAGIC = b'VFSTXN\x00\x00'
+    # magic, sequence number of the first live transaction, its offset in the journal
+    HEADER = struct.Struct('<8sQI')
+    # magic, sequence number, number of cluster images, crc32 of indices and images
+    DESCRIPTOR = struct.Struct('<8sQII')
+
+    def __init__(self, disk):
+        self.disk = disk
+        self.start = 0
+        self.length = 0
+        self._sequence = 1
+        self._head = 1  # offset of the next transaction, relative to start
+        self.maxClustersPerTransaction = (disk.cluster_size - Journal.DESCRIPTOR.size) // 4
+
+    @property
+    def enabled(self):
+        return self.length > 0
+
+    # ---------------------------------------------------------
+    def replay(self):
+        """Apply every committed transaction that was not checkpointed. Returns the count."""
+        sb = self.disk.sb_manager
+        self.start, self.length = sb.journalStart, sb.journalLength
+        if not self.enabled:
+            return 0
+
+        magic, sequence, offset = Journal.HEADER.unpack_from(self.disk.read_through(self.start))
+        if magic != Journal.MAGIC:
+            sequence, offset = 1, 1
+
+        replayed = 0
+        while True:
+            record = self._readTransaction(offset, sequence)
+            if record is None:
+                break
+            for clusterIndex, image in record:
+                self.disk.write_through(clusterIndex, image)
+            replayed += 1
+            sequence += 1
+            offset += 1 + len(record)
+
+        self._sequence = sequence
+        self._reset()
+        return replayed
+
+    def _readTransaction(self, offset, sequence):
+        """Return [(cluster, image), ...] for a valid transaction at offset, else None."""
+        if offset >= self.length:
+            return None
+        descriptor = self.disk.read_through(self.start + offset)
+        magic, txnSequence, count, crc = Journal.DESCRIPTOR.unpack_from(descriptor)
+        if magic != Journal.TXN_MAGIC or txnSequence != sequence:
+            return None
+        if count > self.maxClustersPerTransaction or offset + 1 + count > self.length:
+            return None
+        indices = struct.unpack_from(f'<{count}i', descriptor, Journal.DESCRIPTOR.size)
+        images = [self.disk.read_through(self.start + offset + 1 + i) for i in range(count)]
+        if Journal._checksum(indices, images) != crc:
+            return None  # Torn write: the transaction never committed
+        return list(zip(indices, images))
+
+    @staticmethod
+    def _checksum(indices, images):
+        crc = zlib.crc32(struct.pack(f'<{len(indices)}i', *indices))
+        for image in images:
+            crc = zlib.crc32(image, crc)
+        return crc
+
+    # ---------------------------------------------------------
+    def create(self, fatManager, length=None):
+        """Reserve a contiguous journal region and record it in the superblock.
+
+        The length defaults to JOURNAL_CLUSTERS, scaled down on small disks.
+        Leaves the journal disabled if no free run of that length exists. On a
+        disk that already has a journal, makes sure the FAT still holds its
+        region (see _claimRegion).
+        """
+        if self.enabled:
+            self._claimRegion(fatManager)
+            return True
+        if length is None:
+            contentClusters = self.disk.cluster_count - self.disk.content_start
+            length = min(FsConstants.JOURNAL_CLUSTERS, max(FsConstants.MIN_JOURNAL_CLUSTERS, contentClusters // 32))
+        start = fatManager.findFreeRun(length)
+        if start is None:
+            return False
+
+        # An empty log goes in first, so nothing left in these free clusters
+        # can pass for a transaction
+        self.disk.write_through(start, Journal.HEADER.pack(Journal.MAGIC, 1, 1))
+        self.disk.write_through(start + 1, b'')
+        # The superblock is the region's owner, so it is made durable before
+        # the FAT allocates the region. A crash in between leaves a region the
+        # FAT shows as free, which the next mount claims again; the FAT never
+        # holds a region nothing points at.
+        sb = self.disk.sb_manager
+        sb.journalStart, sb.journalLength = start, length
+        sb.save()
+        self.disk.fsync()
+
+        self.start, self.length = start, length
+        self._sequence = 1
+        self._head = 1
+        self._claimRegion(fatManager)
+        return True
+
+    def _claimRegion(self, fatManager):
+        """Allocate the journal region in the FAT if a crash during create() left it free."""
+        region = range(self.start, self.start + self.length)
+        entries = [fatManager.getFatEntry(cluster) for cluster in region]
+        if entries == [cluster + 1 for cluster in region[:-1]] + [-1]:
+            return
+        if any(entries):
+            raise IOError("Journal region overlaps allocated clusters")
+        fatManager.reserveRun(self.start, self.length)
+        fatManager.flushFatToDisk()
+
+    def _reset(self):
+        """Mark every logged transaction as checkpointed (home clusters must be durable)."""
+        self.disk.write_through(self.start, Journal.HEADER.pack(Journal.MAGIC, self._sequence, 1))
+        self.disk.fsync()
+        self._head = 1
+
+    def checkpoint(self):
+        """Make all checkpointed home clusters durable and empty the log."""
+        if not self.enabled:
+            return
+        self.disk.fsync()
+        self._reset()
+
+    # ---------------------------------------------------------
+    def commit(self, writes):
+        """Log {cluster: image} durably, then copy the images to their home clusters."""
+        if not writes:
+            self.disk.flush_file()
+            return
+
+        indices = sorted(writes)
+        count = len(indices)
+        if count > self.maxClustersPerTransaction or count + 1 > self.length - 1:
+            # Too large to log in one piece: empty the log first so an older
+            # transaction is never replayed over these clusters, then write in place
+            self.checkpoint()
+            for clusterIndex in indices:
+                self.disk.write_home(clusterIndex, writes[clusterIndex])
+            self.disk.fsync()
+            return
+
+        if self._head + 1 + count > self.length:
+            # Out of log space: make the checkpointed clusters durable and wrap around
+            self.checkpoint()
+
+        images = [writes[clusterIndex] for clusterIndex in indices]
+        descriptor = Journal.DESCRIPTOR.pack(
+            Journal.TXN_MAGIC, self._sequence, count, Journal._checksum(indices, images),
+        ) + struct.pack(f'<{count}i', *indices)
+        position = self.start + self._head
+        self.disk.write_through(position, descriptor)
+        for i, image in enumerate(images):
+            self.disk.write_through(position + 1 + i, image)
+        # The single durability point: covers the log and any data written before it
+        self.disk.fsync()
+
+        self._head += 1 + count
+        self._sequence += 1
+        for clusterIndex in indices:
+            self.disk.write_home(clusterIndex, writes[clusterIndex])
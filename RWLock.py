@@ -0,0 +1,79 @@
+import threading
+from contextlib import contextmanager
+
+
+class RWLock:
+    """Reader/writer lock: many readers or one writer at a time.
+
+    Waiting writers block new readers, so a steady stream of readers cannot
+    starve them. Both sides are reentrant per thread, and the thread holding
+    the write lock may also take the read lock.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = {}  # thread id -> read lock depth
+        self._writer = None  # thread id of the writer
+        self._writerDepth = 0
+        self._writersWaiting = 0
+
+    def acquireRead(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me or me in self._readers:
+                self._readers[me] = self._readers.get(me, 0) + 1
+                return
+            while self._writer is not None or self._writersWaiting:
+                self._cond.wait()
+            self._readers[me] = 1
+
+    def releaseRead(self):
+        me = threading.get_ident()
+        with self._cond:
+            depth = self._readers[me] - 1
+            if depth:
+                self._readers[me] = depth
+            else:
+                del self._readers[me]
+                if not self._readers:
+                    self._cond.notify_all()
+
+    def acquireWrite(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer == me:
+                self._writerDepth += 1
+                return
+            if me in self._readers:
+                raise RuntimeError("Cannot upgrade a read lock to a write lock")
+            self._writersWaiting += 1
+            try:
+                while self._writer is not None or self._readers:
+                    self._cond.wait()
+            finally:
+                self._writersWaiting -= 1
+            self._writer = me
+            self._writerDepth = 1
+
+    def releaseWrite(self):
+        with self._cond:
+            self._writerDepth -= 1
+            if not self._writerDepth:
+                self._writer = None
+                self._cond.notify_all()
+
+    @contextmanager
+    def read(self):
+        self.acquireRead()
+        try:
+            yield self
+        finally:
+            self.releaseRead()
+
+    @contextmanager
+    def write(self):
+        self.acquireWrite()
+        try:
+            yield self
+        finally:
+            self.releaseWrite()
@@ -1,5 +1,6 @@
 import os
-from FsConstants import FsConstants
+from Defragmenter import Defragmenter
+from DentryCache import DentryCache
 
 
 class Shell:
@@ -7,8 +8,9 @@ class Shell:
         self.currentPath = "H:/"
         self.directory = directory
         self.fileSystem = fileSystem
-        self.currentCluster = FsConstants.ROOT_DIR_FIRST_CLUSTER
+        self.currentCluster = fileSystem.disk.root_cluster
         self.pathStack = []  # Stack to track parent clusters for cd ..
+        self.defragmenter = None  # Kept between 'defrag <n>' calls so a pass can resume
 
     def run(self):
         """Main shell loop."""
@@ -57,6 +59,14 @@ class Shell:
                         self.echo(args)
                     case "rename":
                         self.rename(args)
+                    case "find":
+                        self.find(args)
+                    case "du":
+                        self.du(args)
+                    case "frag":
+                        self.frag(args)
+                    case "defrag":
+                        self.defrag(args)
                     case _:
                         print(f"Unknown command: {command}. Type 'help' for available commands.")
             except EOFError:
@@ -77,16 +87,21 @@ class Shell:
 Available commands:
   help              - Show this help message
   ls                - List directory contents
-  cd <dir>          - Change directory (use '..' for parent)
+  cd <path>         - Change directory (a/b, ../x, H:/a/b; use '..' for parent)
   mkdir <name>      - Create a new directory
   rmdir <name>      - Remove an empty directory
   touch <name>      - Create a new empty file
-  rm <name>         - Delete a file
+  rm [-r] <name>    - Delete a file (-r: a directory and everything in it)
   cat <file>        - Display file contents
   echo <text> > <file> - Write text to a file
   rename <old> <new> - Rename a file or directory
-  cp <src> <dest>   - Copy a file
+  cp [-r] <src> <dest> - Copy a file (-r: a directory and everything in it)
   mv <src> <dest>   - Move a file
+  find [path] [-name <glob>] [-type f|d] [-size [+|-]<bytes>] [-maxdepth <n>] [-prune <glob>]
+                    - Search a directory tree
+  du [path]         - Show how much space a file or directory tree uses
+  frag <name>       - Show how fragmented a file or directory is
+  defrag [n]        - Defragment the disk (at most n clusters per run, resumable)
   clear             - Clear the screen
   exit              - Exit the shell
 """)
@@ -125,21 +140,32 @@ Available commands:
             # Already in current directory, do nothing
             return
         
-        # Find the directory entry
-        de = self.directory.findDirectoryEntry(self.currentCluster, path)
-        if not de:
-            print(f"Directory not found: {path}")
-            return
-        
-        if de.attr != 0x01:
-            print(f"Not a directory: {path}")
+        # Resolve the whole path (absolute 'H:/a/b', relative 'a/b', '../x') through the dentry cache
+        components = DentryCache.splitPath(path, self._currentComponents())
+        if self.fileSystem.dentryCache.lookup(components) is None:
+            parentCluster = self.fileSystem.dentryCache.lookup(components[:-1]) if components else None
+            de = self.directory.findDirectoryEntry(parentCluster, components[-1]) if parentCluster is not None else None
+            if de:
+                print(f"Not a directory: {path}")
+            else:
+                print(f"Directory not found: {path}")
             return
         
-        # Pushes current location onto pathStack before navigation
-        self.pathStack.append((self.currentCluster, self.currentPath))
-        self.currentCluster = de.firstCluster
-        # update currentPath
-        self.currentPath = self.currentPath.rstrip("/") + "/" + de.name.strip() + "/"
+        self._setLocation(components)
+
+    def _currentComponents(self):
+        return DentryCache.splitPath(self.currentPath)
+
+    def _setLocation(self, components):
+        """Move to the directory at components, rebuilding pathStack for 'cd ..'."""
+        dentryCache = self.fileSystem.dentryCache
+        # Every prefix was cached while resolving components
+        self.pathStack = [
+            (dentryCache.lookup(components[:i]), DentryCache.joinPath(components[:i]))
+            for i in range(len(components))
+        ]
+        self.currentCluster = dentryCache.lookup(components)
+        self.currentPath = DentryCache.joinPath(components)
 
     def clear(self):
         """Clear the terminal screen."""
@@ -147,10 +173,13 @@ Available commands:
 
     
     def cp(self, args):
-        """Copy a file."""
+        """Copy a file, or a directory tree with -r."""
         parts = args.split()
+        recursive = bool(parts) and parts[0] == "-r"
+        if recursive:
+            parts = parts[1:]
         if len(parts) != 2:
-            print("Usage: cp <source> <destination>")
+            print("Usage: cp [-r] <source> <destination>")
             return
         
         source, dest = parts
@@ -167,7 +196,8 @@ Available commands:
             print(f"Destination path invalid: {dest}")
             return
         
-        if self.fileSystem.copyFile(sourceCluster, sourceFile, destCluster, destFile):
+        copy = self.fileSystem.copyTree if recursive else self.fileSystem.copyFile
+        if copy(sourceCluster, sourceFile, destCluster, destFile):
             print(f"Copied {source} to {dest}")
 
     def mv(self, args):
@@ -214,14 +244,21 @@ Available commands:
         if self.fileSystem.deleteDirectory(self.currentCluster, dirName):
             print(f"Removed directory: {dirName}")
 
-    def rm(self, fileName):
-        """Delete a file."""
-        fileName = fileName.strip()
-        if not fileName:
-            print("Usage: rm <file_name>")
+    def rm(self, args):
+        """Delete a file, or a directory tree with -r."""
+        parts = args.split()
+        recursive = bool(parts) and parts[0] == "-r"
+        if recursive:
+            parts = parts[1:]
+        if len(parts) != 1:
+            print("Usage: rm [-r] <file_name>")
             return
         
-        if self.fileSystem.deleteFile(self.currentCluster, fileName):
+        fileName = parts[0]
+        if recursive:
+            if self.fileSystem.deleteTree(self.currentCluster, fileName):
+                print(f"Deleted: {fileName}")
+        elif self.fileSystem.deleteFile(self.currentCluster, fileName):
             print(f"Deleted file: {fileName}")
 
     def touch(self, fileName):
@@ -288,13 +325,10 @@ Available commands:
             self.fileSystem.createFile(fileCluster, actualFileName)
             self.fileSystem.writeFile(fileCluster, actualFileName, text)
         elif append_mode:
-            # Append to existing file
-            existing_content = self.fileSystem.readFile(fileCluster, actualFileName)
-            if existing_content:
-                new_content = existing_content + "\n" + text
-            else:
-                new_content = text
-            self.fileSystem.writeFile(fileCluster, actualFileName, new_content)
+            # Append to existing file, only the tail of the file is rewritten
+            if de.fileSize:
+                text = "\n" + text
+            self.fileSystem.appendFile(fileCluster, actualFileName, text)
         else:
             # Overwrite existing file
             self.fileSystem.writeFile(fileCluster, actualFileName, text)
@@ -313,10 +347,132 @@ Available commands:
         if self.fileSystem.renameEntry(self.currentCluster, oldName, newName):
             print(f"Renamed {oldName} to {newName}")
 
+    def frag(self, path):
+        """Report how many contiguous runs a file's clusters are split into."""
+        path = path.strip()
+        if not path:
+            print("Usage: frag <name>")
+            return
+
+        parentCluster, name = self._resolvePath(path)
+        if parentCluster is None or name is None:
+            print(f"Invalid path: {path}")
+            return
+
+        result = self.fileSystem.getFragmentation(parentCluster, name)
+        if result:
+            clusters, runs = result
+            print(f"{path}: {clusters} cluster(s) in {runs} run(s)")
+
+    def find(self, args):
+        """Search a directory tree by name, type and size, printing matches as they are found."""
+        usage = "Usage: find [path] [-name <glob>] [-type f|d] [-size [+|-]<bytes>] [-maxdepth <n>] [-prune <glob>]"
+        parts = args.split()
+        path = ""
+        if parts and not parts[0].startswith("-"):
+            path = parts.pop(0)
+        if len(parts) % 2:
+            print(usage)
+            return
+
+        filters = {}
+        for option, value in zip(parts[::2], parts[1::2]):
+            if option == "-name":
+                filters["name"] = value
+            elif option == "-prune":
+                filters["prune"] = value
+            elif option == "-type" and value in ("f", "d"):
+                filters["entryType"] = value
+            elif option == "-maxdepth" and value.isdigit() and int(value) > 0:
+                filters["maxDepth"] = int(value)
+            elif option == "-size" and value.lstrip("+-").isdigit():
+                size = int(value.lstrip("+-"))
+                # +n: more than n bytes, -n: fewer than n bytes, n: exactly n bytes
+                if value[0] == "+":
+                    filters["minSize"] = size + 1
+                elif value[0] == "-":
+                    filters["maxSize"] = size - 1
+                else:
+                    filters["minSize"] = filters["maxSize"] = size
+            else:
+                print(usage)
+                return
+
+        components = DentryCache.splitPath(path, self._currentComponents()) if path else self._currentComponents()
+        directoryCluster = self.fileSystem.dentryCache.lookup(components)
+        if directoryCluster is None:
+            print(f"Directory not found: {path}")
+            return
+
+        base = path.rstrip("/") or "."
+        found = 0
+        for entryPath, entry in self.fileSystem.find(directoryCluster, **filters):
+            print(f"{base}/{entryPath}/" if entry.attr == 0x01 else f"{base}/{entryPath}")
+            found += 1
+        if not found:
+            print("No matches")
+
+    def du(self, path):
+        """Report the files, directories and space used by a path (default: the current directory)."""
+        path = path.strip()
+        if not path:
+            usage = self.fileSystem.diskUsage(self.currentCluster)
+        else:
+            parentCluster, name = self._resolvePath(path)
+            if parentCluster is None or name is None:
+                print(f"Invalid path: {path}")
+                return
+            usage = self.fileSystem.diskUsage(parentCluster, name)
+        if usage:
+            print(
+                f"{path or self.currentPath}: {usage['bytes']} byte(s) in {usage['files']} file(s), "
+                f"{usage['directories']} director(ies), {usage['clusters']} cluster(s) used"
+            )
+
+    def defrag(self, args):
+        """Defragment the disk, optionally moving at most n clusters per call."""
+        args = args.strip()
+        limit = None
+        if args:
+            if not args.isdigit() or int(args) < 1:
+                print("Usage: defrag [max_clusters]")
+                return
+            limit = int(args)
+
+        if self.defragmenter is None:
+            self.defragmenter = Defragmenter(self.fileSystem)
+
+        before = self.defragmenter.measureFragmentation()
+        moved = self.defragmenter.step(limit)
+        after = self.defragmenter.measureFragmentation()
+        # Directories may have moved, including the current one
+        self._refreshLocation()
+
+        print(f"Moved {moved} cluster(s)")
+        print(f"Fragmented entries: {before['fragmented']}/{before['entries']} -> {after['fragmented']}/{after['entries']}")
+        print(f"Total runs: {before['runs']} -> {after['runs']}")
+        if self.defragmenter.isDone():
+            if self.defragmenter.entriesSkipped:
+                print(f"Skipped {self.defragmenter.entriesSkipped} entr(ies): no free run large enough")
+            print("Defragmentation complete")
+            self.defragmenter = None
+        else:
+            print("Paused, run 'defrag' again to continue")
+
+    def _refreshLocation(self):
+        """Re-resolve currentPath from the root after directory clusters have changed."""
+        dentryCache = self.fileSystem.dentryCache
+        components = self._currentComponents()
+        # Stay in the deepest directory of the old path that still exists
+        while dentryCache.lookup(components) is None:
+            components = components[:-1]
+        self._setLocation(components)
+
     def _resolvePath(self, path):
             """Resolve a path to a cluster and filename.
             Returns (clusterNumber, fileName) or (None, None) if path is invalid.
-            Handles formats like 'filename', './dirname/filename', 'dirname/filename'
+            Handles formats like 'filename', './dirname/filename', 'dirname/filename',
+            '../filename' and absolute 'H:/dirname/filename'
             """
             path = path.strip()
             
@@ -324,21 +480,16 @@ Available commands:
             if '/' not in path:
                 return (self.currentCluster, path)
             
-            # Parse path
-            parts = path.split('/')
-            parts = [p for p in parts if p and p != '.']  # Remove empty and '.'
-            
-            if not parts:
+            # Split off the last component, which is the filename
+            path = path.rstrip('/')
+            separator = path.rfind('/')
+            parentPath, fileName = path[:separator + 1], path[separator + 1:]
+            if fileName in ('', '.', '..') or fileName.upper() == DentryCache.DRIVE:
                 return (None, None)
             
-            # Navigate to parent directory
-            currentCluster = self.currentCluster
-            for dirName in parts[:-1]:
-                de = self.directory.findDirectoryEntry(currentCluster, dirName)
-                if not de or de.attr != 0x01:
-                    return (None, None)
-                currentCluster = de.firstCluster
-            
-            # Last part is the filename
-            fileName = parts[-1]
-            return (currentCluster, fileName)
+            # Navigate to parent directory through the dentry cache
+            components = DentryCache.splitPath(parentPath, self._currentComponents())
+            parentCluster = self.fileSystem.dentryCache.lookup(components)
+            if parentCluster is None:
+                return (None, None)
+            return (parentCluster, fileName)
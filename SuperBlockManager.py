@@ -1,9 +1,36 @@
+import struct
 from FsConstants import FsConstants
 
 class SuperBlockManager:
+    MAGIC = b'VFSSUPER'
+    VERSION = 3
+    FLAG_DIRTY = 0x0001  # Set while mounted, cleared on a clean unmount
+    # magic, version, flags, cluster size, cluster count, FAT first cluster,
+    # FAT length, root directory cluster, first content cluster,
+    # free content clusters (valid after a clean unmount), journal first cluster, journal length,
+    # first cluster of the shared-chain reference count table
+    LAYOUT = struct.Struct('<8sHHIIIIIIIIII')
+    # Version 2 had no reference count table
+    LAYOUT_V2 = struct.Struct('<8sHHIIIIIIIII')
+    # Version 1 only recorded the journal: magic, version, journal first cluster, journal length
+    LAYOUT_V1 = struct.Struct('<8sHII')
+
     def __init__(self, disk):
         self.disk = disk
-        
+        self.formatted = False
+        self.dirty = True
+        self.clusterSize = FsConstants.CLUSTER_SIZE
+        self.clusterCount = FsConstants.CLUSTER_COUNT
+        self.fatStart = FsConstants.FAT_START_CLUSTER
+        self.fatLength = FsConstants.FAT_END_CLUSTER - FsConstants.FAT_START_CLUSTER + 1
+        self.rootCluster = FsConstants.ROOT_DIR_FIRST_CLUSTER
+        self.contentStart = FsConstants.CONTENT_START_CLUSTER
+        self.freeClusters = 0
+        self.journalStart = 0
+        self.journalLength = 0
+        self.refTableStart = 0
+        self.load()
+
 
     def read_superblock(self):
         # Read the superblock from the disk
@@ -12,4 +39,56 @@ class SuperBlockManager:
 
     def write_superblock(self, data):
         # Write the superblock to the disk
-        self.disk.write_cluster(FsConstants.SUPERBLOCK_CLUSTER, data)
\ No newline at end of file
+        self.disk.write_cluster(FsConstants.SUPERBLOCK_CLUSTER, data, metadata=True)
+
+    def load(self):
+        """Read the superblock fields. Returns False if the disk has no formatted superblock.
+
+        Disks without a superblock, or with an older version, are reported as
+        dirty so their counters get rebuilt from the FAT.
+        """
+        data = self.read_superblock()
+        magic, version = struct.unpack_from('<8sH', data)
+        self.formatted = magic == SuperBlockManager.MAGIC
+        if not self.formatted:
+            self.dirty = True
+            return False
+
+        if version == 1:
+            _, _, self.journalStart, self.journalLength = SuperBlockManager.LAYOUT_V1.unpack_from(data)
+            self.dirty = True
+            return True
+
+        if version == 2:
+            fields = SuperBlockManager.LAYOUT_V2.unpack_from(data) + (0,)
+        else:
+            fields = SuperBlockManager.LAYOUT.unpack_from(data)
+        (_, _, flags, self.clusterSize, self.clusterCount, self.fatStart, self.fatLength,
+         self.rootCluster, self.contentStart, self.freeClusters,
+         self.journalStart, self.journalLength, self.refTableStart) = fields
+        self.dirty = bool(flags & SuperBlockManager.FLAG_DIRTY)
+        return True
+
+    def save(self):
+        """Write the superblock fields to the superblock cluster."""
+        flags = SuperBlockManager.FLAG_DIRTY if self.dirty else 0
+        self.write_superblock(SuperBlockManager.LAYOUT.pack(
+            SuperBlockManager.MAGIC, SuperBlockManager.VERSION, flags,
+            self.clusterSize, self.clusterCount, self.fatStart, self.fatLength,
+            self.rootCluster, self.contentStart, self.freeClusters,
+            self.journalStart, self.journalLength, self.refTableStart,
+        ))
+        self.formatted = True
+
+    def isClean(self):
+        """True when the last unmount was clean, so the cached counters can be trusted."""
+        return self.formatted and not self.dirty
+
+    def markMounted(self):
+        self.dirty = True
+        self.save()
+
+    def markClean(self, freeClusters):
+        self.freeClusters = freeClusters
+        self.dirty = False
+        self.save()
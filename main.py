@@ -17,8 +17,9 @@ if __name__ == "__main__":
         disk.initialize(disk_path, create_if_missing=True)
         
         # Initialize all managers
-        sb = SuperBlockManager(disk)
-        fat = FATManager(disk)
+        # Reuse the managers created by the disk so free-space queries see the live FAT
+        sb = disk.sb_manager
+        fat = disk.fat_manager
         directory = Directory(disk, fat)
         fileSystem = FileSystem(disk, fat, directory)
         
@@ -0,0 +1,47 @@
+import os
+import sys
+
+import pytest
+
+# The modules live at the top of the repository, next to main.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from virtual_disk import VirtualDisk
+from Directory import Directory
+from FileSystem import FileSystem
+
+
+@pytest.fixture
+def diskPath(tmp_path):
+    return str(tmp_path / "disk.bin")
+
+
+@pytest.fixture
+def mount(diskPath):
+    """Return a function that mounts the test disk and returns a FileSystem on it."""
+    disks = []
+
+    def mountDisk(cacheClusters=0, **geometry):
+        disk = VirtualDisk(cache_clusters=cacheClusters)
+        disk.initialize(diskPath, **geometry)
+        disks.append(disk)
+        fat = disk.fat_manager
+        return FileSystem(disk, fat, Directory(disk, fat))
+
+    yield mountDisk
+    for disk in disks:
+        if disk.is_open:
+            disk.close()
+
+
+@pytest.fixture
+def crash():
+    """Return a function that drops a mounted disk the way a crash would.
+
+    Nothing cached is written back and no clean unmount is recorded.
+    """
+    def crashDisk(disk):
+        disk.disk_file.close()
+        disk.is_open = False
+
+    return crashDisk
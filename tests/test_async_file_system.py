@@ -0,0 +1,40 @@
+import asyncio
+import time
+
+from AsyncFileSystem import AsyncFileSystem
+
+
+def testCancelledCallKeepsEntryLockedUntilItFinishes(mount, monkeypatch):
+    fs = mount()
+    root = fs.disk.root_cluster
+    fs.createFile(root, "A.TXT")
+    log = []
+    appendFile, readFile = fs.appendFile, fs.readFile
+
+    def slowAppend(*args):
+        log.append("append start")
+        time.sleep(0.2)
+        result = appendFile(*args)
+        log.append("append end")
+        return result
+
+    def loggedRead(*args):
+        log.append("read")
+        return readFile(*args)
+
+    monkeypatch.setattr(fs, "appendFile", slowAppend)
+    monkeypatch.setattr(fs, "readFile", loggedRead)
+
+    async def main():
+        async with AsyncFileSystem(fs) as afs:
+            task = asyncio.create_task(afs.appendFile(root, "A.TXT", "data"))
+            while not log:
+                await asyncio.sleep(0.01)
+            task.cancel()
+            data = await afs.readFile(root, "A.TXT")
+            assert task.cancelled()
+            assert afs._entryLocks == {}
+            return data
+
+    assert asyncio.run(main()) == "data"
+    assert log == ["append start", "append end", "read"]
@@ -0,0 +1,199 @@
+import tracemalloc
+
+import pytest
+
+from FATManager import FATManager
+
+
+def _firstCluster(fs, parent, name):
+    return fs.directory.findDirectoryEntry(parent, name).firstCluster
+
+
+def _cloneSource(fs, data=b"source data"):
+    root = fs.disk.root_cluster
+    fs.createFile(root, "A.TXT")
+    fs.writeFile(root, "A.TXT", data)
+    assert fs.copyFile(root, "A.TXT", root, "B.TXT")
+    return root
+
+
+def testCloneSharesChain(mount):
+    fs = mount()
+    root = _cloneSource(fs)
+    first = _firstCluster(fs, root, "A.TXT")
+    assert _firstCluster(fs, root, "B.TXT") == first
+    assert fs.fat.isShared(first)
+    assert fs.fat.getRefCount(first) == 2
+    assert fs.readFileBytes(root, "B.TXT") == b"source data"
+
+
+def testWritingCloneLeavesSourceUnchanged(mount):
+    fs = mount()
+    root = _cloneSource(fs)
+    first = _firstCluster(fs, root, "A.TXT")
+    free = fs.fat.getFreeClusterCount()
+
+    with fs.open(root, "B.TXT", "r+") as f:
+        f.write(b"CLONE")
+
+    # The clone got its own chain; the source keeps the shared one, now unshared
+    assert _firstCluster(fs, root, "A.TXT") == first
+    assert _firstCluster(fs, root, "B.TXT") != first
+    assert not fs.fat.isShared(first)
+    assert fs.fat.getFreeClusterCount() == free - 1
+    assert fs.readFileBytes(root, "A.TXT") == b"source data"
+    assert fs.readFileBytes(root, "B.TXT") == b"CLONEe data"
+
+    fs.disk.close()
+    fs = mount()
+    assert fs.readFileBytes(root, "A.TXT") == b"source data"
+    assert fs.readFileBytes(root, "B.TXT") == b"CLONEe data"
+
+
+def testWritingSourceLeavesCloneUnchanged(mount):
+    fs = mount()
+    root = _cloneSource(fs)
+    assert fs.appendFile(root, "A.TXT", b"!")
+    assert fs.writeFileAt(root, "B.TXT", 0, b"S")
+    assert fs.readFileBytes(root, "A.TXT") == b"source data!"
+    assert fs.readFileBytes(root, "B.TXT") == b"Source data"
+
+
+def testRefCountsPersistAcrossRemount(mount):
+    fs = mount()
+    root = _cloneSource(fs)
+    assert fs.copyFile(root, "A.TXT", root, "C.TXT")
+    first = _firstCluster(fs, root, "A.TXT")
+    fs.disk.close()
+
+    fs = mount()
+    assert fs.fat.getRefCount(first) == 3
+    assert fs.writeFile(root, "C.TXT", b"replaced")
+    assert fs.fat.getRefCount(first) == 2
+    fs.disk.close()
+
+    fs = mount()
+    assert fs.fat.getRefCount(first) == 2
+    assert fs.readFileBytes(root, "A.TXT") == b"source data"
+    assert fs.readFileBytes(root, "B.TXT") == b"source data"
+    assert fs.readFileBytes(root, "C.TXT") == b"replaced"
+
+
+def testDeletingOneCopyKeepsTheOther(mount):
+    fs = mount()
+    root = _cloneSource(fs)
+    first = _firstCluster(fs, root, "A.TXT")
+    free = fs.fat.getFreeClusterCount()
+
+    assert fs.deleteFile(root, "A.TXT")
+    assert not fs.fat.isShared(first)
+    assert fs.fat.getFreeClusterCount() == free
+    assert fs.readFileBytes(root, "B.TXT") == b"source data"
+
+    # The last reference frees the chain
+    assert fs.deleteFile(root, "B.TXT")
+    assert fs.fat.getFatEntry(first) == 0
+    assert fs.fat.getFreeClusterCount() == free + 1
+
+
+def testTruncatingCloneKeepsSourceData(mount):
+    fs = mount()
+    size = fs.disk.cluster_size
+    data = bytes(range(256)) * (3 * size // 256)
+    root = _cloneSource(fs, data)
+
+    with fs.open(root, "B.TXT", "r+") as f:
+        f.truncate(size + 10)
+    assert fs.readFileBytes(root, "A.TXT") == data
+    assert fs.readFileBytes(root, "B.TXT") == data[:size + 10]
+    assert len(fs.fat.followChain(_firstCluster(fs, root, "A.TXT"))) == 3
+    assert len(fs.fat.followChain(_firstCluster(fs, root, "B.TXT"))) == 2
+
+
+def testFailedBatchRollsBackRefCounts(mount):
+    fs = mount()
+    root = _cloneSource(fs)
+    first = _firstCluster(fs, root, "A.TXT")
+
+    class Abort(Exception):
+        pass
+
+    with pytest.raises(Abort):
+        with fs.batch():
+            assert fs.copyFile(root, "A.TXT", root, "C.TXT")
+            assert fs.deleteFile(root, "B.TXT")
+            assert fs.fat.getRefCount(first) == 2
+            raise Abort()
+
+    assert fs.fat.getRefCount(first) == 2
+    assert fs.directory.findDirectoryEntry(root, "C.TXT") is None
+    assert fs.readFileBytes(root, "B.TXT") == b"source data"
+    fs.disk.close()
+
+    fs = mount()
+    assert fs.fat.getRefCount(first) == 2
+    assert fs.directory.findDirectoryEntry(root, "C.TXT") is None
+
+
+def testFailedFirstCloneRollsBackRefTable(mount):
+    fs = mount()
+    root = fs.disk.root_cluster
+    fs.createFile(root, "A.TXT")
+    fs.writeFile(root, "A.TXT", b"data")
+    free = fs.fat.getFreeClusterCount()
+
+    class Abort(Exception):
+        pass
+
+    # The first clone allocates the reference count table; rolling back must drop it
+    with pytest.raises(Abort):
+        with fs.batch():
+            assert fs.copyFile(root, "A.TXT", root, "B.TXT")
+            raise Abort()
+
+    assert not fs.disk.sb_manager.refTableStart
+    assert fs.fat.getFreeClusterCount() == free
+    fs.disk.close()
+
+    fs = mount()
+    assert not fs.disk.sb_manager.refTableStart
+    assert not fs.fat.isShared(_firstCluster(fs, root, "A.TXT"))
+
+
+def testCopyOnWriteUsesBoundedMemory(mount):
+    fs = mount(cluster_size=4096, cluster_count=4096)
+    size = 6 * 1024 * 1024
+    data = bytes(range(256)) * (size // 256)
+    root = _cloneSource(fs, data)
+
+    tracemalloc.start()
+    try:
+        assert fs.appendFile(root, "B.TXT", b"!")
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < 3 * FATManager.COPY_BUFFER_BYTES
+    assert fs.readFileBytes(root, "B.TXT") == data + b"!"
+    assert fs.readFileBytes(root, "A.TXT") == data
+
+
+def testRolledBackCopyOnWriteKeepsReusedClusters(mount):
+    fs = mount()
+    root = _cloneSource(fs, b"clone data")
+    fs.createFile(root, "X.TXT")
+    fs.writeFile(root, "X.TXT", b"x data")
+    xCluster = _firstCluster(fs, root, "X.TXT")
+
+    class Abort(Exception):
+        pass
+
+    with pytest.raises(Abort):
+        with fs.batch():
+            assert fs.deleteFile(root, "X.TXT")
+            # The copy lands in the cluster X.TXT just gave up
+            assert fs.writeFileAt(root, "B.TXT", 0, b"C")
+            assert _firstCluster(fs, root, "B.TXT") == xCluster
+            raise Abort()
+
+    assert fs.readFileBytes(root, "X.TXT") == b"x data"
+    assert fs.readFileBytes(root, "B.TXT") == b"clone data"
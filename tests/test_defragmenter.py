@@ -0,0 +1,57 @@
+import tracemalloc
+
+from Defragmenter import Defragmenter
+from FATManager import FATManager
+
+
+def testDefragmentationInvalidatesCachedPaths(mount):
+    fs = mount()
+    root = fs.disk.root_cluster
+    assert fs.createDirectory(root, "DOCS")
+    docs = fs.directory.findDirectoryEntry(root, "DOCS").firstCluster
+    assert fs.createDirectory(docs, "SUB")
+    slotsPerCluster = fs.disk.cluster_size // 32
+    for i in range(slotsPerCluster + 1):
+        assert fs.createFile(docs, f"F{i}")
+        # A file in the root after each one breaks DOCS into runs
+        assert fs.createFile(root, f"PAD{i}")
+    assert FATManager.countRuns(fs.fat.followChain(docs)) > 1
+    sub = fs.dentryCache.lookup(("DOCS", "SUB"))
+    assert fs.dentryCache.lookup(("DOCS",)) == docs
+
+    Defragmenter(fs).run()
+    moved = fs.directory.findDirectoryEntry(root, "DOCS").firstCluster
+    assert moved != docs
+    assert fs.fat.getFatEntry(docs) == 0
+    assert fs.dentryCache.lookup(("DOCS",)) == moved
+    assert fs.dentryCache.lookup(("DOCS", "SUB")) == sub
+
+    # A file created through the cached path lands in the real DOCS
+    assert fs.createFile(fs.dentryCache.lookup(("DOCS",)), "NEW.TXT")
+    assert "NEW.TXT" in [de.name for de in fs.listDirectory(moved)]
+
+
+def testRelocationUsesBoundedMemory(mount):
+    fs = mount(cluster_size=4096, cluster_count=4096)
+    root = fs.disk.root_cluster
+    piece = fs.disk.cluster_size * 256
+    fs.createFile(root, "BIG")
+    fs.createFile(root, "PAD")
+    # Alternate appends so BIG ends up in several runs
+    for i in range(6):
+        assert fs.appendFile(root, "BIG", bytes([i]) * piece)
+        assert fs.appendFile(root, "PAD", b"p" * fs.disk.cluster_size)
+    first = fs.directory.findDirectoryEntry(root, "BIG").firstCluster
+    assert FATManager.countRuns(fs.fat.followChain(first)) > 1
+    assert fs.deleteFile(root, "PAD")
+
+    tracemalloc.start()
+    try:
+        Defragmenter(fs).run()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < 3 * FATManager.COPY_BUFFER_BYTES
+    first = fs.directory.findDirectoryEntry(root, "BIG").firstCluster
+    assert FATManager.countRuns(fs.fat.followChain(first)) == 1
+    assert fs.readFileBytes(root, "BIG") == b"".join(bytes([i]) * piece for i in range(6))
@@ -0,0 +1,45 @@
+def _listed(fs, cluster):
+    return [de.name for de in fs.directory.readDirectoryEntry(cluster)]
+
+
+def _scanned(fs, cluster):
+    return [de.name for de in fs.directory.scanDirectory(cluster)]
+
+
+def testListingFollowsDiskOrder(mount):
+    fs = mount()
+    root = fs.disk.root_cluster
+    slotsPerCluster = fs.disk.cluster_size // 32
+    # Enough entries to spill into a second cluster
+    names = [f"F{i}" for i in range(slotsPerCluster + 4)]
+    for name in names:
+        assert fs.createFile(root, name)
+    assert fs.deleteFile(root, "F1")
+    assert fs.createFile(root, "NEW")  # reuses F1's slot
+    assert fs.renameEntry(root, "F0", "RENAMED")  # stays in its slot
+
+    expected = ["RENAMED", "NEW"] + names[2:]
+    assert _listed(fs, root) == expected
+    assert _scanned(fs, root) == expected
+
+    # A scan without the cache decodes the slots directly
+    fs.directory.invalidate(root)
+    assert _scanned(fs, root) == expected
+    fs.disk.close()
+
+    fs = mount()
+    assert _listed(fs, root) == expected
+
+
+def testListedEntriesAreCopies(mount):
+    fs = mount()
+    root = fs.disk.root_cluster
+    assert fs.createFile(root, "A.TXT")
+    assert fs.writeFile(root, "A.TXT", b"data")
+
+    for entries in (fs.directory.readDirectoryEntry(root), list(fs.directory.scanDirectory(root))):
+        entries[0].fileSize = 0
+        entries[0].name = "B.TXT"
+    de = fs.directory.findDirectoryEntry(root, "A.TXT")
+    assert de.fileSize == 4
+    assert fs.readFileBytes(root, "A.TXT") == b"data"
@@ -0,0 +1,213 @@
+import pytest
+
+from Defragmenter import Defragmenter
+from Directory import Directory, DirectoryEntry
+from DirectoryIndex import DirectoryIndex
+from FATManager import FATManager
+
+THRESHOLD = 8
+
+
+@pytest.fixture(autouse=True)
+def smallThreshold(monkeypatch):
+    # Directories get their on-disk index after a handful of entries
+    monkeypatch.setattr(Directory, "INDEX_THRESHOLD", THRESHOLD)
+
+
+def _makeDirectory(fs, name="DIR"):
+    root = fs.disk.root_cluster
+    assert fs.createDirectory(root, name)
+    return fs.directory.findDirectoryEntry(root, name).firstCluster
+
+
+def _names(fs, cluster):
+    return sorted(de.name for de in fs.directory.readDirectoryEntry(cluster))
+
+
+def _diskIndex(fs, cluster):
+    return DirectoryIndex.open(fs.disk, fs.fat, cluster)
+
+
+def testIndexBuiltWhenSlotZeroIsOccupied(mount):
+    fs = mount()
+    directory = _makeDirectory(fs)
+    names = [f"F{i}.TXT" for i in range(THRESHOLD)]
+    for name in names:
+        assert fs.createFile(directory, name)
+        if name == names[0]:
+            assert fs.disk.read_cluster(directory)[:2] == b"F0"
+
+    # The first file gave slot 0 up to the marker and kept its contents
+    diskIndex = _diskIndex(fs, directory)
+    assert diskIndex is not None
+    assert diskIndex.used == THRESHOLD
+    assert _names(fs, directory) == sorted(names)
+    fs.disk.close()
+
+    fs = mount()
+    for name in names:
+        de = fs.directory.findDirectoryEntry(directory, name)
+        assert de is not None and de.name == name
+    assert _names(fs, directory) == sorted(names)
+
+
+def testColdPathAddRemoveAndRename(mount):
+    fs = mount()
+    directory = _makeDirectory(fs)
+    for i in range(THRESHOLD):
+        assert fs.createFile(directory, f"F{i}")
+    fs.disk.close()
+
+    # After a remount nothing is cached, so changes go through the on-disk index
+    fs = mount()
+    assert fs.createFile(directory, "NEW")
+    assert fs.deleteFile(directory, "F0")
+    assert fs.renameEntry(directory, "F1", "RENAMED")
+    assert directory not in fs.directory._index
+    assert fs.directory.findDirectoryEntry(directory, "NEW") is not None
+    assert fs.directory.findDirectoryEntry(directory, "F0") is None
+    assert fs.directory.findDirectoryEntry(directory, "F1") is None
+    assert fs.directory.findDirectoryEntry(directory, "RENAMED") is not None
+    assert _diskIndex(fs, directory).used == THRESHOLD
+    fs.disk.close()
+
+    fs = mount()
+    expected = sorted(["NEW", "RENAMED"] + [f"F{i}" for i in range(2, THRESHOLD)])
+    assert _names(fs, directory) == expected
+    for name in expected:
+        assert fs.directory.findDirectoryEntry(directory, name).name == name
+
+
+def testIndexGrowsAndDeleteTreeFreesEverything(mount):
+    fs = mount()
+    free = fs.fat.getFreeClusterCount()
+    directory = _makeDirectory(fs)
+    for i in range(THRESHOLD):
+        assert fs.createFile(directory, f"F{i}")
+    fs.disk.close()
+
+    # Enough cold-path inserts to outgrow the smallest table and rebuild it
+    fs = mount()
+    count = DirectoryIndex.MIN_CAPACITY
+    for i in range(THRESHOLD, count):
+        assert fs.createFile(directory, f"F{i}")
+    diskIndex = _diskIndex(fs, directory)
+    assert diskIndex.capacity > DirectoryIndex.MIN_CAPACITY
+    assert diskIndex.used == count
+    assert diskIndex.deleted == 0
+    fs.disk.close()
+
+    fs = mount()
+    for i in range(count):
+        assert fs.directory.findDirectoryEntry(directory, f"F{i}") is not None
+    assert fs.deleteTree(fs.disk.root_cluster, "DIR")
+    assert fs.fat.getFreeClusterCount() == free
+    fs.disk.close()
+
+    fs = mount()
+    assert fs.fat.getFreeClusterCount() == free
+
+
+def testRemapAfterDefragmentation(mount):
+    fs = mount()
+    root = fs.disk.root_cluster
+    directory = _makeDirectory(fs)
+    slotsPerCluster = fs.disk.cluster_size // Directory.ENTRY_SIZE
+    names = [f"F{i}" for i in range(3 * slotsPerCluster)]
+    for i, name in enumerate(names):
+        assert fs.createFile(directory, name)
+        # A file in the root after each one breaks the directory's chain into runs
+        assert fs.createFile(root, f"PAD{i}")
+    assert FATManager.countRuns(fs.fat.followChain(directory)) > 1
+    oldChain = fs.fat.followChain(directory)
+
+    Defragmenter(fs).run()
+    newFirst = fs.directory.findDirectoryEntry(root, "DIR").firstCluster
+    chain = fs.fat.followChain(newFirst)
+    assert chain != oldChain
+    assert FATManager.countRuns(chain) == 1
+    # Every index record names a slot in the directory's new clusters
+    records = list(_diskIndex(fs, newFirst)._records())
+    assert len(records) == len(names)
+    assert all(cluster in chain for _, cluster, _ in records)
+    fs.disk.close()
+
+    fs = mount()
+    for name in names:
+        assert fs.directory.findDirectoryEntry(newFirst, name).name == name
+    assert fs.deleteFile(newFirst, names[0])
+    assert fs.directory.findDirectoryEntry(newFirst, names[0]) is None
+
+
+def testFailedBatchDropsNewIndex(mount):
+    fs = mount()
+    directory = _makeDirectory(fs)
+    free = fs.fat.getFreeClusterCount()
+
+    class Abort(Exception):
+        pass
+
+    with pytest.raises(Abort):
+        with fs.batch():
+            for i in range(THRESHOLD):
+                assert fs.createFile(directory, f"F{i}")
+            assert _diskIndex(fs, directory) is not None
+            raise Abort()
+
+    assert _diskIndex(fs, directory) is None
+    assert fs.fat.getFreeClusterCount() == free
+    assert _names(fs, directory) == []
+    fs.disk.close()
+
+    fs = mount()
+    assert _diskIndex(fs, directory) is None
+    assert fs.fat.getFreeClusterCount() == free
+
+
+def testFailedBatchLeavesIndexUnchanged(mount):
+    fs = mount()
+    directory = _makeDirectory(fs)
+    for i in range(THRESHOLD):
+        assert fs.createFile(directory, f"F{i}")
+    fs.disk.close()
+
+    fs = mount()
+
+    class Abort(Exception):
+        pass
+
+    with pytest.raises(Abort):
+        with fs.batch():
+            assert fs.createFile(directory, "NEW")
+            assert fs.deleteFile(directory, "F0")
+            raise Abort()
+
+    assert fs.directory.findDirectoryEntry(directory, "NEW") is None
+    assert fs.directory.findDirectoryEntry(directory, "F0") is not None
+    assert _diskIndex(fs, directory).used == THRESHOLD
+
+
+@pytest.mark.parametrize("name", ["\x01ABC", "A\x00B", "\x7fX", "", "!!!", ".TXT", "A.B.C"])
+def testInvalidNamesAreRejected(mount, name):
+    fs = mount()
+    root = fs.disk.root_cluster
+    fs.createFile(root, "OK.TXT")
+    before = _names(fs, root)
+
+    assert not fs.createFile(root, name)
+    assert not fs.createDirectory(root, name)
+    assert not fs.renameEntry(root, "OK.TXT", name)
+    assert not fs.copyFile(root, "OK.TXT", root, name)
+    assert not fs.moveFile(root, "OK.TXT", root, name)
+    assert _names(fs, root) == before
+
+
+def testMarkerByteIsNeverAnEntry(mount):
+    fs = mount()
+    directory = _makeDirectory(fs)
+    # A stray marker byte in any slot is skipped like the real marker
+    stray = bytes([DirectoryIndex.MARKER]) + DirectoryEntry.directoryEntryToBytes(DirectoryEntry("X", 0x00))[1:]
+    fs.directory._writeSlot(directory, 3, stray)
+    fs.directory.invalidate(directory)
+    assert _names(fs, directory) == []
+    assert DirectoryIndex.open(fs.disk, fs.fat, directory) is None
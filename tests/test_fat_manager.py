@@ -0,0 +1,74 @@
+import random
+
+import pytest
+
+
+def _scannedRuns(fat):
+    """Free runs found by scanning the free map, as start -> length."""
+    runs = {}
+    freeMap = fat._freeMap
+    start = freeMap.find(1, fat.disk.content_start)
+    while start != -1:
+        end = freeMap.find(0, start)
+        if end == -1:
+            end = len(freeMap)
+        runs[start] = end - start
+        start = freeMap.find(1, end)
+    return runs
+
+
+def _checkRunIndex(fat):
+    runs = _scannedRuns(fat)
+    assert fat._runLength == runs
+    assert fat._runEnd == {start + length: start for start, length in runs.items()}
+    byLength = {}
+    for start, length in runs.items():
+        byLength.setdefault(length, set()).add(start)
+    assert fat._runsByLength == byLength
+    assert fat._runLengths == sorted(byLength)
+
+
+def testBestFitTakesSmallestHole(mount):
+    fs = mount()
+    fat = fs.fat
+    heads = [fat.allocateChain(size, zeroFill=False) for size in (3, 1, 2, 1, 5, 1)]
+    fat.allocateChain(1, zeroFill=False)  # keeps the last hole apart from the free space after it
+    for head in heads[0::2]:
+        fat.freeChain(head)
+
+    assert fat.allocateChain(2, zeroFill=False) == heads[2]
+    assert fat.allocateChain(4, zeroFill=False) == heads[4]
+    assert fat.allocateChain(3, zeroFill=False) == heads[0]
+    _checkRunIndex(fat)
+
+
+def testRunIndexFollowsFatChanges(mount):
+    fs = mount()
+    fat = fs.fat
+    rng = random.Random(7)
+    chains = []
+    for _ in range(400):
+        action = rng.random()
+        if action < 0.5 or not chains:
+            chains.append(fat.allocateChain(rng.randint(1, 6), zeroFill=False))
+        elif action < 0.8:
+            fat.freeChain(chains.pop(rng.randrange(len(chains))))
+        else:
+            fat.addClustersToChain(rng.choice(chains), rng.randint(1, 3), zeroFill=False)
+    _checkRunIndex(fat)
+
+    class Abort(Exception):
+        pass
+
+    with pytest.raises(Abort):
+        with fs.batch():
+            for head in chains[:20]:
+                fat.freeChain(head)
+            fat.allocateChain(30, zeroFill=False)
+            raise Abort()
+    _checkRunIndex(fat)
+
+    fs.disk.close()
+    fs = mount()
+    fs.fat._ensureFreeMap()
+    _checkRunIndex(fs.fat)
@@ -0,0 +1,76 @@
+import pytest
+
+
+def testWriteAfterDeleteDoesNotReachReusedClusters(mount):
+    fs = mount()
+    root = fs.disk.root_cluster
+    fs.createFile(root, "A.TXT")
+    handle = fs.open(root, "A.TXT", "r+")
+    first = handle.firstCluster
+
+    assert fs.deleteFile(root, "A.TXT")
+    assert fs.createFile(root, "B.TXT")
+    assert fs.writeFile(root, "B.TXT", b"data of B")
+    assert fs.directory.findDirectoryEntry(root, "B.TXT").firstCluster == first
+
+    with pytest.raises(IOError):
+        handle.write(b"X" * 50)
+    with pytest.raises(IOError):
+        handle.truncate(0)
+    handle.close()
+    assert fs.readFileBytes(root, "B.TXT") == b"data of B"
+
+
+def testFlushAfterRewriteKeepsNewChain(mount):
+    fs = mount()
+    root = fs.disk.root_cluster
+    fs.createFile(root, "C.TXT")
+    fs.writeFile(root, "C.TXT", b"old")
+    handle = fs.open(root, "C.TXT", "r+")
+    handle.write(b"handle data")
+
+    assert fs.writeFile(root, "C.TXT", b"rewritten")
+    entry = fs.directory.findDirectoryEntry(root, "C.TXT")
+    with pytest.raises(IOError):
+        handle.write(b"more")
+    with pytest.raises(IOError):
+        handle.close()
+    assert handle.closed
+
+    # The entry still owns the chain writeFile gave it
+    after = fs.directory.findDirectoryEntry(root, "C.TXT")
+    assert (after.firstCluster, after.fileSize) == (entry.firstCluster, entry.fileSize)
+    assert fs.fat.getFatEntry(after.firstCluster) == -1
+    assert fs.readFileBytes(root, "C.TXT") == b"rewritten"
+
+
+def testFailedFlushFreesPrivateCopy(mount):
+    fs = mount()
+    root = fs.disk.root_cluster
+    fs.createFile(root, "A.TXT")
+    fs.writeFile(root, "A.TXT", b"shared")
+    assert fs.copyFile(root, "A.TXT", root, "B.TXT")
+    free = fs.fat.getFreeClusterCount()
+
+    handle = fs.open(root, "B.TXT", "r+")
+    handle.write(b"S")  # copy-on-write gives the handle its own cluster
+    assert fs.fat.getFreeClusterCount() == free - 1
+    assert fs.deleteFile(root, "B.TXT")
+    with pytest.raises(IOError):
+        handle.close()
+
+    assert fs.fat.getFreeClusterCount() == free
+    assert fs.readFileBytes(root, "A.TXT") == b"shared"
+
+
+def testHandleSeesItsOwnFlushes(mount):
+    fs = mount()
+    root = fs.disk.root_cluster
+    fs.createFile(root, "A.TXT")
+    with fs.open(root, "A.TXT", "r+") as handle:
+        handle.write(b"one")
+        handle.flush()
+        handle.write(b"two")
+        handle.flush()
+        handle.truncate(4)
+    assert fs.readFileBytes(root, "A.TXT") == b"onet"
@@ -0,0 +1,85 @@
+import pytest
+
+from FATManager import FATManager
+from FsConstants import FsConstants
+from virtual_disk import VirtualDisk
+
+
+def testReplayRestoresSuperblockChanges(mount, crash):
+    fs = mount(cacheClusters=256)
+    root = fs.disk.root_cluster
+    fs.createFile(root, "A.TXT")
+    fs.writeFile(root, "A.TXT", "original")
+    fs.disk.close()
+
+    # Cloning allocates the reference count table, which the superblock records
+    fs = mount(cacheClusters=256)
+    assert fs.copyFile(root, "A.TXT", root, "B.TXT")
+    refTableStart = fs.disk.sb_manager.refTableStart
+    assert refTableStart
+    crash(fs.disk)
+
+    fs = mount(cacheClusters=256)
+    assert fs.disk.sb_manager.refTableStart == refTableStart
+    assert fs.fat.isShared(fs.directory.findDirectoryEntry(root, "A.TXT").firstCluster)
+    with fs.open(root, "B.TXT", "r+") as f:
+        f.write(b"CHANGED!")
+    assert fs.readFileBytes(root, "A.TXT") == b"original"
+    assert fs.readFileBytes(root, "B.TXT") == b"CHANGED!"
+
+
+def testReplayAfterCrashKeepsCommittedFiles(mount, crash):
+    fs = mount(cacheClusters=256)
+    root = fs.disk.root_cluster
+    fs.createDirectory(root, "DOCS")
+    docs = fs.directory.findDirectoryEntry(root, "DOCS").firstCluster
+    fs.createFile(docs, "NOTE.TXT")
+    fs.writeFile(docs, "NOTE.TXT", "kept")
+    free = fs.fat.getFreeClusterCount()
+    crash(fs.disk)
+
+    fs = mount(cacheClusters=256)
+    assert fs.readFile(docs, "NOTE.TXT") == "kept"
+    assert fs.fat.getFreeClusterCount() == free
+    assert not fs.disk.sb_manager.isClean()
+
+
+def _journalRegionIsAllocated(fs):
+    journal = fs.disk.journal
+    region = range(journal.start, journal.start + journal.length)
+    return [fs.fat.getFatEntry(cluster) for cluster in region] == [cluster + 1 for cluster in region[:-1]] + [-1]
+
+
+def testJournalSizeScalesWithDisk(mount, diskPath, tmp_path):
+    small = mount()
+    assert small.disk.journal.length == (small.disk.cluster_count - small.disk.content_start) // 32
+    assert _journalRegionIsAllocated(small)
+
+    large = VirtualDisk()
+    large.initialize(str(tmp_path / "large.bin"), cluster_count=8192)
+    assert large.journal.length == FsConstants.JOURNAL_CLUSTERS
+    large.close()
+
+
+def testCrashBeforeJournalIsAllocatedIsRecovered(mount, crash, monkeypatch):
+    class Crash(Exception):
+        pass
+
+    def crashInstead(self, startCluster, count):
+        raise Crash()
+
+    # The superblock records the region, then the process dies before the FAT does
+    with monkeypatch.context() as patch:
+        patch.setattr(FATManager, "reserveRun", crashInstead)
+        with pytest.raises(IOError):
+            mount()
+
+    fs = mount()
+    journal = fs.disk.journal
+    assert journal.enabled and _journalRegionIsAllocated(fs)
+    free = fs.fat.getFreeClusterCount()
+    assert free == fs.disk.cluster_count - fs.disk.content_start - journal.length
+
+    # New chains never land in the region
+    start = fs.fat.allocateChain(free)
+    assert not set(fs.fat.followChain(start)) & set(range(journal.start, journal.start + journal.length))
@@ -0,0 +1,63 @@
+import threading
+
+
+def _startWriter(target):
+    done = threading.Event()
+
+    def run():
+        target()
+        done.set()
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, done
+
+
+def testHandleWritesWaitForDirectoryReaders(mount):
+    fs = mount()
+    root = fs.disk.root_cluster
+    fs.createFile(root, "A.TXT")
+    handle = fs.open(root, "A.TXT", "r+")
+
+    for change in (lambda: handle.write(b"data"), handle.flush, lambda: handle.truncate(2)):
+        with fs.lockDirectories([root], write=False):
+            thread, done = _startWriter(change)
+            # The writer needs the parent directory's write lock
+            assert not done.wait(0.2)
+        thread.join(5)
+        assert done.is_set()
+    handle.close()
+    assert fs.readFileBytes(root, "A.TXT") == b"da"
+
+
+def testOpenLooksUpUnderReadLock(mount):
+    fs = mount()
+    root = fs.disk.root_cluster
+    fs.createFile(root, "A.TXT")
+    result = []
+    with fs.lockDirectories([root]):
+        thread, done = _startWriter(lambda: result.append(fs.open(root, "A.TXT", "r")))
+        assert not done.wait(0.2)
+    thread.join(5)
+    assert result[0] is not None
+
+
+def testStagedClustersOnlyVisibleToBatchOwner(mount):
+    fs = mount()
+    disk = fs.disk
+    cluster = disk.cluster_count - 2
+    disk.write_cluster(cluster, b"committed")
+    seen = []
+
+    def readOther():
+        seen.append((bytes(disk.read_cluster(cluster)[:9]), bytes(disk.read_extent(cluster, 2)[:9])))
+
+    disk.begin_batch()
+    disk.write_cluster(cluster, b"staged!!!")
+    assert disk.read_cluster(cluster)[:9] == b"staged!!!"
+    thread = threading.Thread(target=readOther)
+    thread.start()
+    thread.join(5)
+    disk.discard_batch()
+    assert seen == [(b"committed", b"committed")]
+    assert disk.read_cluster(cluster)[:9] == b"committed"
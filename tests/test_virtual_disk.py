@@ -0,0 +1,18 @@
+from virtual_disk import MappedVirtualDisk, VirtualDisk
+
+
+def testMappedDiskClosesWithLiveView(diskPath):
+    disk = MappedVirtualDisk()
+    disk.initialize(diskPath)
+    cluster = disk.cluster_count - 1
+    disk.write_cluster(cluster, b"mapped")
+    view = disk.view_cluster(cluster)
+    assert view.readonly
+    disk.close()
+    assert bytes(view[:6]) == b"mapped"
+    view.release()
+
+    disk = VirtualDisk()
+    disk.initialize(diskPath)
+    assert disk.read_cluster(cluster)[:6] == b"mapped"
+    disk.close()
@@ -1,43 +1,86 @@
 import os
+import mmap
+import threading
+from collections import OrderedDict
 from FsConstants import FsConstants
 from SuperBlockManager import SuperBlockManager
 from FATManager import FATManager
+from Journal import Journal
+
+# os.pread/os.pwrite are not available on every platform (e.g. Windows)
+_POSITIONAL_IO = hasattr(os, "pread") and hasattr(os, "pwrite")
 
 class VirtualDisk:
 
-    def __init__(self):
+    # ---------------------------------------------------------
+    # Parameters:
+    #   cache_clusters (int): Maximum number of clusters kept in the in-memory
+    #                         write-back cache. 0 (default) disables the cache.
+    # ---------------------------------------------------------
+    def __init__(self, cache_clusters=0):
         self.disk_size = 0
+        self.cluster_size = FsConstants.CLUSTER_SIZE
+        self.cluster_count = FsConstants.CLUSTER_COUNT
+        self.fat_start = FsConstants.FAT_START_CLUSTER
+        self.fat_end = FsConstants.FAT_END_CLUSTER
+        self.root_cluster = FsConstants.ROOT_DIR_FIRST_CLUSTER
+        self.content_start = FsConstants.CONTENT_START_CLUSTER
         self.disk_path = None
         self.disk_file = None
         self.is_open = False
         self.fat_manager = None
         self.sb_manager = None
+        self.journal = None
+
+        if cache_clusters < 0:
+            raise ValueError("Cache size cannot be negative")
+        self.cache_clusters = cache_clusters
+        self._cache = OrderedDict()  # cluster index -> bytes, least recently used first
+        self._dirty = set()          # cached clusters not yet written to the disk file
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_evictions = 0
+        self._staged = None          # cluster index -> bytes while a batch is open
+        self._batch_owner = None     # thread that opened the batch; only it sees the staged clusters
+        # Guards the cache, the staged batch and journal commits. Reads that
+        # touch neither go straight to positional I/O without it.
+        self._lock = threading.RLock()
+        self._staged_metadata = set()  # staged clusters holding FAT/directory/superblock data
 
     # ---------------------------------------------------------
     # Initializes the virtual disk.
-    # - If the disk file exists, opens it for read/write access.
+    # - If the disk file exists, opens it for read/write access and takes its
+    #   geometry from the superblock (disks without one use the defaults).
     # - If it does not exist and create_if_missing is True, creates a new empty virtual disk file.
     # - Raises an error if the disk is already initialized or if the file cannot be opened/created.
     #
     # Parameters:
     #   path (str): The file path of the virtual disk.
     #   create_if_missing (bool): Whether to create the file if it doesn't exist (default: True).
+    #   cluster_size (int): Cluster size in bytes for a new disk, a power of two
+    #                       between MIN_CLUSTER_SIZE and MAX_CLUSTER_SIZE.
+    #   cluster_count (int): Number of clusters for a new disk.
+    #                        Both default to FsConstants; for an existing disk
+    #                        they must match its superblock when given.
     #
     # Raises:
     #   RuntimeError: If the disk is already initialized.
     #   FileNotFoundError: If the disk file is missing and creation is disabled.
-    #   IOError: If the disk cannot be opened or created due to I/O issues.
+    #   IOError: If the disk cannot be opened or created due to I/O issues,
+    #            or if the requested geometry is invalid.
     # ---------------------------------------------------------
-    def initialize(self, path, create_if_missing=True):
+    def initialize(self, path, create_if_missing=True, cluster_size=None, cluster_count=None):
         if self.is_open:
             raise RuntimeError("Disk is already initialized")
 
         self.disk_path = path
-        self.disk_size = FsConstants.CLUSTER_COUNT * FsConstants.CLUSTER_SIZE
-
-
 
         try:
+            self._set_geometry(
+                FsConstants.CLUSTER_SIZE if cluster_size is None else cluster_size,
+                FsConstants.CLUSTER_COUNT if cluster_count is None else cluster_count,
+            )
+
             is_new_disk = not os.path.exists(self.disk_path)
             if is_new_disk:
                 if create_if_missing:
@@ -47,38 +90,105 @@ class VirtualDisk:
             
             # Always open the disk file
             self.disk_file = open(self.disk_path, "r+b")
+            self._open_backend()
             self.is_open = True
             
             # Initialize managers after disk file is open
-            self.fat_manager = FATManager(self)
             self.sb_manager = SuperBlockManager(self)
-            
-            # Load FAT only if disk already existed
-            if not is_new_disk:
-                try:
-                    self.fat_manager.LoadFatFromDisk()
-                except Exception as ex:
-                    print(f"Warning: Failed to load FAT from disk: {ex}")
+            if is_new_disk:
+                sb = self.sb_manager
+                sb.clusterSize, sb.clusterCount = self.cluster_size, self.cluster_count
+                sb.fatStart, sb.fatLength = self.fat_start, self.fat_end - self.fat_start + 1
+                sb.rootCluster, sb.contentStart = self.root_cluster, self.content_start
             else:
-                # Only initialize clusters for brand new disks
-                for cluster_index in range(FsConstants.CLUSTER_COUNT):
-                    if cluster_index == FsConstants.SUPERBLOCK_CLUSTER:
-                        self.sb_manager.write_superblock(data=bytes([0x00] * FsConstants.CLUSTER_SIZE))
-                    elif cluster_index >= FsConstants.CONTENT_START_CLUSTER:
-                        self.write_cluster(cluster_index)
-                    elif cluster_index >= FsConstants.FAT_START_CLUSTER and cluster_index <= FsConstants.FAT_END_CLUSTER:
-                        self.write_cluster(cluster_index, data=bytes([0x00]) * FsConstants.CLUSTER_SIZE)
-
+                self._load_geometry(cluster_size, cluster_count)
+            
+            if is_new_disk:
+                # Content clusters are left as holes in the sparse image: the
+                # FAT marks them free and allocation writes them before use
+                self.sb_manager.write_superblock(data=bytes(self.cluster_size))
+                for cluster_index in range(self.fat_start, self.root_cluster + 1):
+                    self.write_cluster(cluster_index)
+            
+            # Replay committed metadata transactions before the FAT is loaded
+            self.journal = Journal(self)
+            if self.journal.replay():
+                # Replay may have restored a newer superblock than the one loaded above
+                self.sb_manager.load()
+            # Counters cached by a clean unmount can be trusted; otherwise rebuild from the FAT
+            clean = self.sb_manager.isClean()
+            self.fat_manager = FATManager(self, self.sb_manager.freeClusters if clean else None)
+            # Disks created before the journal existed get one on first mount
+            self.journal.create(self.fat_manager)
+            # Stays marked dirty until close() records a clean unmount
+            self.sb_manager.markMounted()
 
         except Exception as ex:
             self.is_open = False
             raise IOError(f"Failed to open disk: {ex}") from ex
 
+    # ---------------------------------------------------------
+    # Sets the disk geometry. The superblock takes cluster 0, the FAT follows
+    # it with one int32 entry per cluster, then one root directory cluster;
+    # everything after that is content.
+    #
+    # Raises:
+    #   ValueError: If the cluster size is not a supported power of two or the
+    #               cluster count leaves no room for content.
+    # ---------------------------------------------------------
+    def _set_geometry(self, cluster_size, cluster_count, fat_length=None):
+        if not (FsConstants.MIN_CLUSTER_SIZE <= cluster_size <= FsConstants.MAX_CLUSTER_SIZE) \
+                or cluster_size & (cluster_size - 1):
+            raise ValueError(
+                f"Cluster size must be a power of two between "
+                f"{FsConstants.MIN_CLUSTER_SIZE} and {FsConstants.MAX_CLUSTER_SIZE} bytes"
+            )
+        if not (0 < cluster_count <= FsConstants.MAX_CLUSTER_COUNT):
+            raise ValueError(f"Cluster count must be between 1 and {FsConstants.MAX_CLUSTER_COUNT}")
+        if fat_length is None:
+            fat_length = -(-cluster_count * FATManager.ENTRY_SIZE // cluster_size)
+
+        self.cluster_size = cluster_size
+        self.cluster_count = cluster_count
+        self.fat_start = FsConstants.SUPERBLOCK_CLUSTER + 1
+        self.fat_end = self.fat_start + fat_length - 1
+        self.root_cluster = self.fat_end + 1
+        self.content_start = self.root_cluster + 1
+        if self.content_start >= cluster_count:
+            raise ValueError("Cluster count leaves no room for file content")
+        self.disk_size = cluster_count * cluster_size
+
+    # ---------------------------------------------------------
+    # Adopts the geometry recorded in an existing disk's superblock.
+    # Disks without a formatted superblock keep the default geometry.
+    #
+    # Raises:
+    #   ValueError: If the superblock disagrees with an explicitly requested
+    #               geometry, or records a layout this version cannot use.
+    # ---------------------------------------------------------
+    def _load_geometry(self, cluster_size, cluster_count):
+        sb = self.sb_manager
+        if cluster_size is not None and cluster_size != sb.clusterSize:
+            raise ValueError(f"Disk was formatted with {sb.clusterSize}-byte clusters")
+        if cluster_count is not None and cluster_count != sb.clusterCount:
+            raise ValueError(f"Disk was formatted with {sb.clusterCount} clusters")
+        resized = sb.clusterSize != self.cluster_size
+        self._set_geometry(sb.clusterSize, sb.clusterCount, sb.fatLength)
+        if (sb.fatStart, sb.rootCluster, sb.contentStart) != (self.fat_start, self.root_cluster, self.content_start):
+            raise ValueError("Superblock records an unsupported layout")
+        if os.path.getsize(self.disk_path) < self.disk_size:
+            raise ValueError("Disk file is smaller than its recorded geometry")
+        if resized:
+            # Cluster 0 was read with the default cluster size
+            self._cache.clear()
+            self._dirty.clear()
+
     # ---------------------------------------------------------
     # Creates a new empty virtual disk file.
-    # - The file is filled with zeroed clusters, each of size CLUSTER_SIZE.
-    # - The total file size equals CLUSTERS_NUMBER × CLUSTER_SIZE.
-    # - Ensures the disk structure is properly initialized before use.
+    # - The file is extended with truncate() to cluster_count × cluster_size
+    #   bytes, so it is sparse where the host file system supports it and
+    #   reads back as zeros everywhere.
+    # - No cluster data is written here; initialize() formats the metadata.
     #
     # Parameters:
     #   path (str): The path where the disk file should be created.
@@ -90,10 +200,7 @@ class VirtualDisk:
         f = None
         try:
             f = open(path, "wb")
-            empty_cluster = bytes(FsConstants.CLUSTER_SIZE)
-            for _ in range(FsConstants.CLUSTER_COUNT):
-                f.write(empty_cluster)
-            f.flush()
+            f.truncate(self.disk_size)
         except Exception as ex:
             raise IOError(f"Failed to create disk file: {ex}") from ex
         finally:
@@ -102,31 +209,55 @@ class VirtualDisk:
     
     # ---------------------------------------------------------
     #Write to cluster
-    def write_cluster(self, cluster_index, data=None, data_offset=0, ):
+    # Set metadata=True for FAT, directory and superblock clusters: when the
+    # disk is journaled those writes are logged before reaching their home cluster.
+    def write_cluster(self, cluster_index, data=None, data_offset=0, metadata=False):
         if not self.is_open:
             raise RuntimeError("Disk is not initialized")
 
-        if not (0 <= cluster_index < FsConstants.CLUSTER_COUNT):
+        if not (0 <= cluster_index < self.cluster_count):
             raise IndexError("Cluster index out of range")
         
         if data is None:
-            data = bytes([0x00]) * FsConstants.CLUSTER_SIZE
+            data = bytes([0x00]) * self.cluster_size
         else:
             data = bytes(data)
             # Pad short writes to full CLUSTER_SIZE so old data is fully overwritten
-            if len(data) < FsConstants.CLUSTER_SIZE:
-                data = data + bytes([0x00]) * (FsConstants.CLUSTER_SIZE - len(data))
+            if len(data) < self.cluster_size:
+                data = data + bytes([0x00]) * (self.cluster_size - len(data))
         
-        if len(data) > FsConstants.CLUSTER_SIZE:
+        if len(data) > self.cluster_size:
             raise ValueError("Data exceeds cluster size")
 
-        try:
-            self.disk_file.seek(cluster_index * FsConstants.CLUSTER_SIZE)
-            self.disk_file.write(data)
-            self.disk_file.flush()
-        except Exception as ex:
-            raise IOError(f"Failed to write to cluster: {ex}") from ex
+        with self._lock:
+            if self._staged is not None:
+                self._staged[cluster_index] = data
+                if metadata:
+                    self._staged_metadata.add(cluster_index)
+                return
+
+            if self._journaled():
+                if metadata:
+                    self.journal.commit({cluster_index: data})
+                else:
+                    # Made durable by the next journal commit, no need to flush now
+                    self._store(cluster_index, data)
+                return
+
+            self._store(cluster_index, data)
+            if not self.cache_clusters:
+                self.disk_file.flush()
 
+    def _journaled(self):
+        return self.journal is not None and self.journal.enabled
+
+    # ---------------------------------------------------------
+    # Hands a full cluster to the cache, or to the disk file when caching is off.
+    def _store(self, cluster_index, data):
+        if self.cache_clusters:
+            self._cache_store(cluster_index, data, dirty=True)
+        else:
+            self._write_to_file(cluster_index, data)
 
     # ---------------------------------------------------------
     # Read cluster
@@ -135,15 +266,302 @@ class VirtualDisk:
         if not self.is_open:
             raise RuntimeError("Disk is not initialized")
 
-        if not (0 <= cluster_index < FsConstants.CLUSTER_COUNT):
+        if not (0 <= cluster_index < self.cluster_count):
             raise IndexError("Cluster index out of range")
 
+        staged = self._visible_staged()
+        if staged is not None:
+            data = staged.get(cluster_index)
+            if data is not None:
+                return data
+
+        if self.cache_clusters:
+            with self._lock:
+                data = self._cache.get(cluster_index)
+                if data is not None:
+                    self.cache_hits += 1
+                    self._cache.move_to_end(cluster_index)
+                    return data
+                self.cache_misses += 1
+                data = self._read_from_file(cluster_index)
+                self._cache_store(cluster_index, data, dirty=False)
+                return data
+
+        # Without the cache, reads need no lock: positional I/O shares no file offset
+        return self._read_from_file(cluster_index)
+
+    # ---------------------------------------------------------
+    # Low-level cluster I/O against the disk file (bypasses the cache).
+    # Writes are not flushed here; callers flush once they are done.
+    def _write_to_file(self, cluster_index, data):
         try:
-            self.disk_file.seek(cluster_index * FsConstants.CLUSTER_SIZE)
-            data = self.disk_file.read(FsConstants.CLUSTER_SIZE)
-            return data
+            self._pwrite(cluster_index * self.cluster_size, data)
+        except Exception as ex:
+            raise IOError(f"Failed to write to cluster: {ex}") from ex
+
+    def _read_from_file(self, cluster_index):
+        try:
+            return self._pread(cluster_index * self.cluster_size, self.cluster_size)
         except Exception as ex:
             raise IOError(f"Failed to read from cluster: {ex}") from ex
+
+    # ---------------------------------------------------------
+    # Positional I/O on the disk file descriptor. It never moves a shared
+    # file offset, so threads can read and write concurrently. Platforms
+    # without os.pread/os.pwrite fall back to seek + read/write under the
+    # disk lock.
+    def _pread(self, offset, size):
+        if _POSITIONAL_IO:
+            return os.pread(self.disk_file.fileno(), size, offset)
+        with self._lock:
+            self.disk_file.seek(offset)
+            return self.disk_file.read(size)
+
+    def _pwrite(self, offset, data):
+        if _POSITIONAL_IO:
+            view = memoryview(data)
+            while view:
+                written = os.pwrite(self.disk_file.fileno(), view, offset)
+                view = view[written:]
+                offset += written
+            return
+        with self._lock:
+            self.disk_file.seek(offset)
+            self.disk_file.write(data)
+            # Keep the buffer empty so later reads see this write
+            self.disk_file.flush()
+
+    # ---------------------------------------------------------
+    # Extent I/O: count consecutive clusters starting at start_cluster are
+    # moved with one read or write against the disk file instead of one
+    # seek + read/write per cluster. Meant for file data.
+    # - read_extent returns count * cluster_size bytes. Clusters with newer
+    #   contents in an open batch or in the write-back cache take precedence
+    #   over the file; the cache is not filled by extent reads.
+    # - write_extent pads data to whole clusters. Inside a batch the clusters
+    #   are staged like write_cluster; otherwise they go straight to the
+    #   file and any cached copies are dropped.
+    def read_extent(self, start_cluster, count):
+        self._check_extent(start_cluster, count)
+        if not self.cache_clusters and self._visible_staged() is None:
+            return self._read_extent_from_file(start_cluster, count)
+        with self._lock:
+            return self._read_extent_overlaid(start_cluster, count)
+
+    def _read_extent_overlaid(self, start_cluster, count):
+        data = self._read_extent_from_file(start_cluster, count)
+        newer = [
+            (cluster_index, self._cache[cluster_index])
+            for cluster_index in self._clusters_in_extent(self._dirty, start_cluster, count)
+        ]
+        staged = self._visible_staged()
+        if staged:
+            # Listed after the cache so staged contents win
+            newer += [
+                (cluster_index, staged[cluster_index])
+                for cluster_index in self._clusters_in_extent(staged, start_cluster, count)
+            ]
+        if not newer:
+            return data
+        data = bytearray(data)
+        for cluster_index, cluster_data in newer:
+            offset = (cluster_index - start_cluster) * self.cluster_size
+            data[offset:offset + self.cluster_size] = cluster_data
+        return bytes(data)
+
+    # bypass_batch=True writes through an open batch (see Batched writes)
+    def write_extent(self, start_cluster, data, bypass_batch=False):
+        if not data:
+            return
+        count = -(-len(data) // self.cluster_size)
+        self._check_extent(start_cluster, count)
+        data = bytes(data).ljust(count * self.cluster_size, b'\x00')
+
+        with self._lock:
+            if self._staged is not None:
+                if not bypass_batch:
+                    for i in range(count):
+                        self._staged[start_cluster + i] = data[i * self.cluster_size:(i + 1) * self.cluster_size]
+                    return
+                # A staged image of these clusters would overwrite this data at commit
+                for cluster_index in self._clusters_in_extent(self._staged, start_cluster, count):
+                    del self._staged[cluster_index]
+                    self._staged_metadata.discard(cluster_index)
+
+            for cluster_index in self._clusters_in_extent(self._cache, start_cluster, count):
+                del self._cache[cluster_index]
+                self._dirty.discard(cluster_index)
+            self._write_extent_to_file(start_cluster, data)
+            if not self._journaled() and not self.cache_clusters:
+                self.disk_file.flush()
+
+    def _check_extent(self, start_cluster, count):
+        if not self.is_open:
+            raise RuntimeError("Disk is not initialized")
+        if count < 1 or start_cluster < 0 or start_cluster + count > self.cluster_count:
+            raise IndexError("Cluster extent out of range")
+
+    # Returns the keys of clusters (a set or dict) that fall inside the extent,
+    # scanning whichever of the two is smaller.
+    @staticmethod
+    def _clusters_in_extent(clusters, start_cluster, count):
+        if len(clusters) < count:
+            return sorted(i for i in clusters if start_cluster <= i < start_cluster + count)
+        return [i for i in range(start_cluster, start_cluster + count) if i in clusters]
+
+    def _read_extent_from_file(self, start_cluster, count):
+        try:
+            return self._pread(start_cluster * self.cluster_size, count * self.cluster_size)
+        except Exception as ex:
+            raise IOError(f"Failed to read from clusters: {ex}") from ex
+
+    def _write_extent_to_file(self, start_cluster, data):
+        try:
+            self._pwrite(start_cluster * self.cluster_size, data)
+        except Exception as ex:
+            raise IOError(f"Failed to write to clusters: {ex}") from ex
+
+    # ---------------------------------------------------------
+    # Batched writes.
+    # - begin_batch() stages every following write_cluster in memory. Reads
+    #   from the thread that began the batch see the staged data; other
+    #   threads keep seeing the committed data until commit_batch().
+    # - commit_batch() applies the staged clusters in cluster order and
+    #   flushes the disk file once.
+    # - discard_batch() drops them without touching the disk.
+    # - write_extent(..., bypass_batch=True) is for clusters the batch itself
+    #   allocated: nothing committed points at them, so their data goes to the
+    #   disk at once instead of being held in memory until commit. If the
+    #   batch is discarded they are free again and the data is never read.
+    def begin_batch(self):
+        if not self.is_open:
+            raise RuntimeError("Disk is not initialized")
+        with self._lock:
+            if self._staged is not None:
+                raise RuntimeError("A batch is already in progress")
+            self._staged = {}
+            self._batch_owner = threading.get_ident()
+
+    def commit_batch(self):
+        with self._lock:
+            if self._staged is None:
+                raise RuntimeError("No batch in progress")
+            staged, metadata = self._staged, self._staged_metadata
+            self._staged = None
+            self._batch_owner = None
+            self._staged_metadata = set()
+
+            if self._journaled():
+                # Data first, then the metadata transaction; its sync covers both
+                for cluster_index in sorted(staged):
+                    if cluster_index not in metadata:
+                        self._store(cluster_index, staged[cluster_index])
+                self.journal.commit({cluster_index: staged[cluster_index] for cluster_index in metadata})
+                return
+
+            for cluster_index in sorted(staged):
+                self._store(cluster_index, staged[cluster_index])
+            self.disk_file.flush()
+
+    def discard_batch(self):
+        with self._lock:
+            self._staged = None
+            self._batch_owner = None
+            self._staged_metadata = set()
+
+    # Returns the open batch's staged clusters if the calling thread owns the
+    # batch, else None.
+    def _visible_staged(self):
+        staged = self._staged
+        if staged is not None and self._batch_owner == threading.get_ident():
+            return staged
+        return None
+
+    # ---------------------------------------------------------
+    # Journal support.
+    # - read_through/write_through access the backend directly, skipping the
+    #   cache and any open batch (used for the journal region and replay).
+    # - write_home places a checkpointed cluster at its home location; it may
+    #   stay in the cache until the next sync.
+    # - fsync writes back the cache and forces everything to stable storage.
+    def read_through(self, cluster_index):
+        return self._read_from_file(cluster_index)
+
+    def write_through(self, cluster_index, data):
+        data = bytes(data).ljust(self.cluster_size, b'\x00')
+        with self._lock:
+            self._write_to_file(cluster_index, data)
+            if self._cache.pop(cluster_index, None) is not None:
+                self._dirty.discard(cluster_index)
+
+    def write_home(self, cluster_index, data):
+        with self._lock:
+            self._store(cluster_index, data)
+
+    def flush_file(self):
+        self.disk_file.flush()
+
+    def fsync(self):
+        self.sync()
+        os.fsync(self.disk_file.fileno())
+
+    # ---------------------------------------------------------
+    # Backend hooks, called right after the disk file is opened and right
+    # before it is closed. The plain file backend needs no extra setup.
+    def _open_backend(self):
+        pass
+
+    def _close_backend(self):
+        pass
+
+    # ---------------------------------------------------------
+    # Returns a read-only memoryview over a cluster's contents.
+    # - The plain file backend wraps the bytes returned by read_cluster, so
+    #   callers can use the same code path for every backend.
+    def view_cluster(self, cluster_index):
+        return memoryview(self.read_cluster(cluster_index))
+
+    # ---------------------------------------------------------
+    # Inserts or refreshes a cluster in the LRU cache.
+    # - Dirty clusters are only written to the disk file when they are
+    #   evicted, on sync() or on close().
+    # - Evicts least recently used clusters while the cache is over capacity.
+    def _cache_store(self, cluster_index, data, dirty):
+        self._cache[cluster_index] = data
+        self._cache.move_to_end(cluster_index)
+        if dirty:
+            self._dirty.add(cluster_index)
+
+        while len(self._cache) > self.cache_clusters:
+            victim, victim_data = self._cache.popitem(last=False)
+            self.cache_evictions += 1
+            if victim in self._dirty:
+                self._dirty.discard(victim)
+                self._write_to_file(victim, victim_data)
+
+    # ---------------------------------------------------------
+    # Writes every dirty cached cluster back to the disk file, in cluster
+    # order, and flushes the file. Cached contents stay valid.
+    def sync(self):
+        if not self.is_open:
+            raise RuntimeError("Disk is not initialized")
+
+        with self._lock:
+            for cluster_index in sorted(self._dirty):
+                self._write_to_file(cluster_index, self._cache[cluster_index])
+            self._dirty.clear()
+            self.disk_file.flush()
+
+    # ---------------------------------------------------------
+    # Returns the cache counters as a dict (hits, misses, evictions, cached, dirty).
+    def getCacheStats(self):
+        return {
+            "hits": self.cache_hits,
+            "misses": self.cache_misses,
+            "evictions": self.cache_evictions,
+            "cached": len(self._cache),
+            "dirty": len(self._dirty),
+        }
         
     # ---------------------------------------------------------
     def getDiskSize(self):
@@ -151,17 +569,13 @@ class VirtualDisk:
     
     # ---------------------------------------------------------
     def getDiskFreeSpaceClusters(self):
-        count = 0
-        # Check FAT to find free clusters (entries marked as 0)
-        for i in range(FsConstants.CONTENT_START_CLUSTER, FsConstants.CLUSTER_COUNT):
-            if self.fat_manager.getFatEntry(i) == 0:
-                count += 1
-        return count
+        # The FAT manager keeps a running count of free content clusters
+        return self.fat_manager.getFreeClusterCount()
     
     # ---------------------------------------------------------
     def getDiskFreeSpacePercent(self):
         free_clusters = self.getDiskFreeSpaceClusters()
-        total_content_clusters = FsConstants.CLUSTER_COUNT - FsConstants.CONTENT_START_CLUSTER
+        total_content_clusters = self.cluster_count - self.content_start
         if total_content_clusters == 0:
             return 0.0
         percent = (free_clusters / total_content_clusters) * 100.0
@@ -169,15 +583,89 @@ class VirtualDisk:
     # ---------------------------------------------------------
     def getDiskFreeSpacebytes(self):
         free_clusters = self.getDiskFreeSpaceClusters()
-        return free_clusters * FsConstants.CLUSTER_SIZE
+        return free_clusters * self.cluster_size
         
     # ---------------------------------------------------------
     # Closes the virtual disk file.
     def close(self):
         if self.is_open and self.disk_file:
-            self.disk_file.flush()
+            if self.fat_manager is not None:
+                self.sb_manager.markClean(self.fat_manager.getFreeClusterCount())
+            self.sync()
+            if self._journaled():
+                # Everything is home and durable now, so nothing needs replaying
+                self.journal.checkpoint()
+            self._close_backend()
             self.disk_file.close()
             self.is_open = False
-            FATManager
+            self._cache.clear()
+
+
+class MappedVirtualDisk(VirtualDisk):
+    """VirtualDisk backend that memory-maps the disk image.
+
+    Cluster reads and writes become memory copies, and view_cluster hands out
+    memoryview slices of the mapping so readers can scan clusters without
+    allocating a new buffer per cluster. Views are read-only: every change
+    goes through write_cluster so batches, the cache and the journal see it.
+    Views should not outlive the disk; one that does keeps the mapping open
+    until it is released.
+    """
+
+    def __init__(self):
+        # The mapping already lives in memory, so the cluster cache is not used.
+        super().__init__(cache_clusters=0)
+        self._map = None
+        self._view = None
+
+    def _open_backend(self):
+        self._map = mmap.mmap(self.disk_file.fileno(), 0)
+        self._view = memoryview(self._map)
+
+    def _close_backend(self):
+        self._view.release()
+        self._view = None
+        try:
+            self._map.close()
+        except BufferError:
+            # A view from view_cluster() is still alive. sync() already wrote
+            # the mapping back; it is unmapped once the last view is released.
+            pass
+        self._map = None
+
+    def _write_to_file(self, cluster_index, data):
+        offset = cluster_index * self.cluster_size
+        self._view[offset:offset + self.cluster_size] = data
+
+    def _read_from_file(self, cluster_index):
+        offset = cluster_index * self.cluster_size
+        return self._map[offset:offset + self.cluster_size]
+
+    def _read_extent_from_file(self, start_cluster, count):
+        offset = start_cluster * self.cluster_size
+        return self._map[offset:offset + count * self.cluster_size]
+
+    def _write_extent_to_file(self, start_cluster, data):
+        offset = start_cluster * self.cluster_size
+        self._view[offset:offset + len(data)] = data
+
+    def _cluster_view(self, cluster_index):
+        if not self.is_open:
+            raise RuntimeError("Disk is not initialized")
+
+        if not (0 <= cluster_index < self.cluster_count):
+            raise IndexError("Cluster index out of range")
+
+        offset = cluster_index * self.cluster_size
+        return self._view[offset:offset + self.cluster_size]
 
+    def view_cluster(self, cluster_index):
+        """Return a read-only view of a cluster, without copying it."""
+        staged = self._visible_staged()
+        if staged is not None and cluster_index in staged:
+            return memoryview(staged[cluster_index])
+        return self._cluster_view(cluster_index).toreadonly()
 
+    def sync(self):
+        super().sync()
+        self._map.flush()